@@ -1,286 +1,806 @@
 import os
+import stat
+import mimetypes
 import time
 import threading
 import signal
 import sys
+import socket
 import logging
-from flask import Flask, request, jsonify, send_from_directory, current_app
+import hashlib
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, send_from_directory, current_app, make_response
 from flask_wtf.csrf import CSRFProtect
-from models import db, Photo
+from sqlalchemy import func, or_, and_, cast, Integer, String
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Photo, PhotoManifest, SchemaInfo, ScanJob, CategoryStats, CategoryStatsDelta
+from migrations import upgrade_database
 from config import Config
-from PIL import Image
+from thumbnailer import (thumbnail_version, supported_formats, variant_path,
+                         thumbnail_mimetype, ThumbnailPool, METADATA_FIELDS, release_shared_thumbnail,
+                         sprite_layout)
+from watcher import PhotoWatcher
+from derivatives import DerivativeCache
+from process_lock import InterProcessLock
+from response_cache import ResponseCache
+from search import apply_search, order_search, detect_tokenizer
+from similarity import phash_columns, similar_condition, rank_similar, DEFAULT_MAX_DISTANCE, MAX_DISTANCE
 
 # 全局状态控制
-db_lock = threading.Lock()
-is_scanning_event = threading.Event()
-is_scanning_event.set()  # 初始状态：扫描完成
+# 扫描状态、进度和结果记录在 scan_jobs 表中（见 models.ScanJob），所有进程看到的一致；
+# 以下只是本进程的线程句柄和停止信号
 server_running = True  # 服务器运行状态标记
-scan_progress = {"total": 0, "processed": 0}  # 扫描进度
+scan_stop_event = threading.Event()  # 置位后扫描在下一个检查点提交并退出
+scan_thread = None  # 启动扫描线程
+photo_watcher = None  # 照片目录监视线程
+background_lock = None  # 后台任务锁（跨进程，保证只有一个进程运行目录监视）
 
+INDEX_GENERATION_KEY = 'index_generation'  # schema_info 中的索引版本号
 
-# 允许的图片文件后缀（与config一致）
-def allowed_file(filename):
-    """检查文件是否为支持的图片类型"""
-    if not filename or '..' in filename or filename.startswith(('.', '~')):
-        return False
+# 索引版本号：扫描或增量索引每次提交时随数据一起递增，各进程据此判断查询缓存是否失效
+_count_cache = {}  # 分类 -> (索引版本号, 照片数)
+_count_cache_lock = threading.Lock()
 
-    # 安全地获取文件扩展名
-    if '.' not in filename:
-        return False
+MAX_PER_PAGE = 100  # 单页最多返回的照片数
+MAX_QUERY_LENGTH = 100  # 检索词最大长度
+SEARCH_COUNT_LIMIT = 10000  # 检索结果计数上限，超过时 total 按上限返回
+FILE_CHUNK_SIZE = 256 * 1024  # 服务器不提供 wsgi.file_wrapper 时逐块读取文件的大小
 
-    # 防止路径遍历攻击
-    if '/' in filename or '\\' in filename:
-        return False
 
-    ext = filename.rsplit('.', 1)[1].lower()
-    return ext in current_app.config['ALLOWED_EXTENSIONS']
+def bump_index_generation():
+    """在当前事务中递增索引版本号（由调用方提交），使所有进程依赖索引内容的缓存失效"""
+    table = SchemaInfo.__table__
+    updated = db.session.execute(
+        table.update()
+        .where(table.c.key == INDEX_GENERATION_KEY)
+        .values(value=cast(cast(table.c.value, Integer) + 1, String))
+    ).rowcount
+    if not updated:
+        SchemaInfo.set_value(INDEX_GENERATION_KEY, 1)
 
 
-def create_thumbnail(src_path, dest_path, size=None):
-    """生成缩略图并保存"""
-    try:
-        # 验证源文件存在且可读
-        if not os.path.exists(src_path) or not os.access(src_path, os.R_OK):
-            current_app.logger.error(f"无法读取源文件: {src_path}")
-            return False
-
-        size = size or current_app.config['THUMBNAIL_MAX_SIZE']
+def current_index_generation():
+    value = db.session.query(SchemaInfo.value).filter(SchemaInfo.key == INDEX_GENERATION_KEY).scalar()
+    return int(value or 0)
 
-        # 验证图片完整性
-        try:
-            with Image.open(src_path) as img:
-                img.verify()  # 验证文件完整性
-        except (IOError, SyntaxError) as e:
-            current_app.logger.error(f"损坏的图片文件: {src_path} - {str(e)}")
-            return False
 
-        # 重新打开图片进行处理
-        with Image.open(src_path) as img:
-            # 转换模式（如果需要）
-            if img.mode not in ('RGB', 'L'):
-                img = img.convert('RGB')
+def count_photos(category=None):
+    """照片数（按分类），读取 category_stats，结果缓存到索引下一次变化为止
 
-            # 保持比例缩放
-            img.thumbnail(size)
+    版本号与计数在同一个读事务中查询，缓存的计数不会比它标记的版本号旧。
+    """
+    key = category or 'all'
+    generation = current_index_generation()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached and cached[0] == generation:
+            return cached[1]
 
-            # 创建目标目录（如果不存在）
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if key == 'all':
+        query = db.session.query(func.sum(CategoryStats.photo_count))
+    else:
+        query = db.session.query(CategoryStats.photo_count).filter(CategoryStats.category == category)
+    count = query.scalar() or 0
 
-            # 保存缩略图
-            img.save(dest_path, optimize=True, quality=85)
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if not cached or cached[0] <= generation:
+            _count_cache[key] = (generation, count)
+    return count
 
-        return True
-    except Exception as e:
-        current_app.logger.error(f"生成缩略图失败 {src_path} -> {dest_path}: {str(e)}")
-        return False
 
+def active_scan_job():
+    """当前进行中的全量扫描任务（可能在其他进程中），没有时返回 None"""
+    return ScanJob.active(current_app.config['SCAN_JOB_STALE_AFTER'])
 
-def count_total_photos(app):
-    """统计照片总数用于进度显示"""
-    photo_root = app.config['PHOTO_FOLDER']
-    total_count = 0
 
-    try:
-        all_items = os.listdir(photo_root)
-    except (FileNotFoundError, PermissionError) as e:
-        app.logger.error(f"无法访问照片根目录: {photo_root} - {str(e)}")
-        return 0
+def scan_job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
 
-    # 遍历photo文件夹下的所有子目录
-    for item in all_items:
-        item_path = os.path.join(photo_root, item)
 
-        # 跳过非目录、隐藏文件和thumbnails目录
-        if (not os.path.isdir(item_path) or
-                item.startswith(('.', '~'))
-                ):
-            continue
+def parse_photo_cursor(value, sort='filename'):
+    """解析键集分页游标 "排序键,id"，无效时返回 None
 
+    按文件名排序时排序键为文件名（本身可能含逗号），按拍摄时间排序时为 ISO 格式时间。
+    """
+    key, sep, photo_id = (value or '').rpartition(',')
+    if not sep or not key or not photo_id.isdigit():
+        return None
+    if sort == 'taken_at':
         try:
-            category_files = os.listdir(item_path)
-        except (PermissionError, NotADirectoryError) as e:
-            app.logger.error(f"无法访问分类目录 '{item_path}': {e}")
-            continue
+            key = datetime.fromisoformat(key)
+        except ValueError:
+            return None
+    return key, int(photo_id)
 
-        # 统计分类目录下的有效图片文件
-        for filename in category_files:
-            file_path = os.path.join(item_path, filename)
 
-            # 跳过隐藏文件和目录，只处理文件
-            if (filename.startswith(('.', '~')) or not os.path.isfile(file_path)):
-                continue
+def make_photo_cursor(photo, sort='filename'):
+    if sort == 'taken_at':
+        return f"{photo.taken_at.isoformat()},{photo.id}"
+    return f"{photo.filename},{photo.id}"
 
-            # 只统计允许的图片文件
-            if allowed_file(filename):
-                total_count += 1
 
-    return total_count
+def parse_date_param(value, end=False):
+    """解析 from / to 参数（ISO 日期或日期时间），返回 datetime；为空返回 None，无效时抛出 ValueError
 
+    只给日期的 to 包含当天：返回次日零点，作为不含的上界。
+    """
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        moment += timedelta(days=1)
+    return moment
 
-def scan_photo_folder(app):
-    """扫描照片目录，生成缩略图并更新数据库"""
-    from models import db, Photo
 
-    logger = app.logger
-
-    photo_root = app.config['PHOTO_FOLDER']
-    thumbnail_root = app.config['THUMBNAIL_FOLDER']
-    new_count = 0
-    update_count = 0
-    error_count = 0
+def _iter_file_range(f, start, length):
+    """逐块读取文件的 [start, start + length) 区间"""
+    f.seek(start)
+    while length > 0:
+        chunk = f.read(min(FILE_CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+def _requested_range(size, etag, mtime):
+    """解析 Range 请求头，返回 (起始, 长度)；不需要分段时返回 None，无法满足时返回 False
+
+    只支持单个区间（多区间请求按完整文件返回）；If-Range 与当前版本不符时也返回完整文件。
+    """
+    if request.range is None or request.range.units != 'bytes' or len(request.range.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and int(mtime) > if_range.date.timestamp():
+        return None
+    byte_range = request.range.range_for_length(size)
+    if byte_range is None:
+        return False
+    start, stop = byte_range
+    return start, stop - start
 
-    # 确保缩略图根目录存在
-    os.makedirs(thumbnail_root, exist_ok=True)
 
-    # 先统计照片总数
-    global scan_progress
-    scan_progress["total"] = count_total_photos(app)
-    scan_progress["processed"] = 0
-    logger.info(f"开始扫描，共发现 {scan_progress['total']} 张照片需要处理")
+def send_cached_file(directory, filename, cache_control, mimetype=None, vary=None):
+    """发送文件并附带基于 (大小, 修改时间) 的 ETag / Last-Modified，支持单区间 Range 请求（206）
 
+    If-None-Match / If-Modified-Since 命中时只 stat 不打开文件，直接返回 304。
+    文件内容交给服务器的 wsgi.file_wrapper 发送（waitress / gunicorn 会用 sendfile 零拷贝发送），
+    有上限的区间和没有 file_wrapper 的服务器（开发服务器）在 Python 中逐块读取。
+    调用方负责路径安全检查。
+    """
+    path = os.path.join(directory, filename)
     try:
-        all_items = os.listdir(photo_root)
-    except (FileNotFoundError, PermissionError) as e:
-        logger.error(f"无法访问照片根目录: {photo_root} - {str(e)}")
-        return {"message": f"错误：无法访问照片根目录 '{photo_root}'", "new": 0, "updated": 0, "errors": 1}
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return jsonify({'error': '资源未找到'}), 404
 
-    # 使用生成器表达式和分批处理来减少内存占用
-    existing_photos_map = {}
-    batch_size = 1000
-    offset = 0
+    etag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and int(st.st_mtime) <= since.timestamp()
+
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        byte_range = _requested_range(st.st_size, etag, st.st_mtime)
+        if byte_range is False:
+            response = make_response('', 416)
+            response.headers['Content-Range'] = f"bytes */{st.st_size}"
+        else:
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                return jsonify({'error': '资源未找到'}), 404
+            start, length = byte_range or (0, st.st_size)
+            file_wrapper = request.environ.get('wsgi.file_wrapper')
+            if file_wrapper is not None and start + length == st.st_size:
+                # 发送到文件末尾：定位起点后交给服务器，服务器按 Content-Length 发送
+                f.seek(start)
+                body = file_wrapper(f, FILE_CHUNK_SIZE)
+            else:
+                body = _iter_file_range(f, start, length)
+            response = current_app.response_class(
+                body,
+                status=206 if byte_range else 200,
+                mimetype=mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                direct_passthrough=True
+            )
+            response.call_on_close(f.close)
+            response.content_length = length
+            if byte_range:
+                response.headers['Content-Range'] = f"bytes {start}-{start + length - 1}/{st.st_size}"
+        response.headers['Accept-Ranges'] = 'bytes'
+
+    response.set_etag(etag)
+    response.last_modified = int(st.st_mtime)
+    response.headers['Cache-Control'] = cache_control
+    if vary:
+        response.headers['Vary'] = vary
+    return response
+
+
+def cached_json_response(cache, key, build):
+    """返回 JSON 响应：同一索引版本内命中缓存时直接使用序列化好的响应体，否则调用 build() 生成
+
+    响应带 ETag（由响应体计算），客户端 If-None-Match 命中时返回 304；
+    Cache-Control: no-cache 让浏览器每次凭 ETag 重新验证，扫描提交后立即看到新数据。
+    """
+    generation = current_index_generation()
+    cached = cache.get(key, generation)
+    if cached is None:
+        cached = cache.put(key, generation, jsonify(build()).get_data())
+    etag, body = cached
+
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def accepted_format(formats):
+    """按服务端偏好顺序选出客户端 Accept 头明确接受的第一种缩略图格式，都不接受时用 JPEG"""
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    for fmt in formats:
+        if fmt == 'jpeg' or thumbnail_mimetype(fmt) in accepted:
+            return fmt
+    return 'jpeg'
+
+
+def find_thumbnail_variant(base_path, formats):
+    """找出客户端可接受且已生成的缩略图文件，返回 (路径, MIME 类型)
+
+    都没有时退回旧版本生成的同名缩略图（原图格式），MIME 类型按扩展名推断。
+    """
+    preferred = accepted_format(formats)
+    for fmt in formats[formats.index(preferred):]:
+        path = variant_path(base_path, fmt)
+        if os.path.isfile(path):
+            return path, thumbnail_mimetype(fmt)
+    if os.path.isfile(base_path):
+        return base_path, None
+    return None, None
+
+
+def sprite_digest(entries, tile_size):
+    """雪碧图内容摘要：由 [(照片 id, 缩略图版本号)] 和格子尺寸得出，任一照片变化后改变"""
+    key = f"{tile_size[0]}x{tile_size[1]}|" + ','.join(f"{photo_id}:{version or ''}" for photo_id, version in entries)
+    return hashlib.blake2s(key.encode(), digest_size=12).hexdigest()
+
+
+def sprite_manifest(photos):
+    """一页照片的雪碧图信息和每张照片在图中的位置 [x, y, 宽, 高]（按页面顺序）"""
+    tile_width, tile_height = current_app.config['SPRITE_TILE_SIZE']
+    columns, rows = sprite_layout(len(photos), current_app.config['SPRITE_COLUMNS'])
+    digest = sprite_digest([(photo.id, photo.thumb_version) for photo in photos], (tile_width, tile_height))
+    ids = ','.join(str(photo.id) for photo in photos)
+    sprite = {
+        'url': f"/sprites/{digest}.jpg?ids={ids}",
+        'width': columns * tile_width,
+        'height': rows * tile_height,
+        'tile_width': tile_width,
+        'tile_height': tile_height
+    }
+    rects = [[(index % columns) * tile_width, (index // columns) * tile_height, tile_width, tile_height]
+             for index in range(len(photos))]
+    return sprite, rects
+
+
+def list_categories():
+    """按名称顺序列出所有分类的统计信息（读取 category_stats，不做聚合查询）"""
+    return CategoryStats.query.filter(CategoryStats.photo_count > 0).order_by(CategoryStats.category).all()
 
-    while True:
-        batch = Photo.query.offset(offset).limit(batch_size).all()
-        if not batch:
-            break
 
-        for photo in batch:
-            key = f"{photo.category}/{photo.filename}"
-            existing_photos_map[key] = photo
+# 允许的图片文件后缀（与config一致）
+def allowed_file(filename):
+    """检查文件是否为支持的图片类型"""
+    if not filename or '..' in filename or filename.startswith(('.', '~')):
+        return False
 
-        offset += batch_size
-        # 释放内存
-        del batch
+    # 安全地获取文件扩展名
+    if '.' not in filename:
+        return False
 
-    # 遍历photo文件夹下的所有子目录
-    for item in all_items:
-        item_path = os.path.join(photo_root, item)
+    # 防止路径遍历攻击
+    if '/' in filename or '\\' in filename:
+        return False
 
-        # 跳过非目录、隐藏文件和thumbnails目录
-        if (not os.path.isdir(item_path) or
-                item.startswith(('.', '~')) or
-                item == 'thumbnails'):
-            continue
+    ext = filename.rsplit('.', 1)[1].lower()
+    return ext in current_app.config['ALLOWED_EXTENSIONS']
 
-        category = item
-        logger.info(f"开始扫描分类: {category}")
 
-        # 确保分类缩略图目录存在
-        category_thumb_dir = os.path.join(thumbnail_root, category)
-        os.makedirs(category_thumb_dir, exist_ok=True)
+def _file_signature(entry):
+    """由 scandir 条目得到文件签名 (大小, 修改时间ns, inode)"""
+    st = entry.stat()
+    return st.st_size, st.st_mtime_ns, entry.inode()
 
-        try:
-            category_files = os.listdir(item_path)
-        except (PermissionError, NotADirectoryError) as e:
-            logger.error(f"无法访问分类目录 '{item_path}': {e}")
-            error_count += 1
-            continue
 
-        # 遍历分类目录下的文件
-        for filename in category_files:
-            file_path = os.path.join(item_path, filename)
+def load_manifest():
+    """读取扫描清单，只查询比对所需的列：{(分类, 文件名): (清单id, 大小, 修改时间ns, inode)}"""
+    rows = db.session.query(
+        PhotoManifest.category, PhotoManifest.filename, PhotoManifest.id,
+        PhotoManifest.size, PhotoManifest.mtime_ns, PhotoManifest.inode
+    ).yield_per(5000)
+    return {(category, filename): (manifest_id, size, mtime_ns, inode)
+            for category, filename, manifest_id, size, mtime_ns, inode in rows}
 
-            # 跳过隐藏文件和目录，只处理文件
-            if (filename.startswith(('.', '~')) or not os.path.isfile(file_path)):
-                continue
 
-            # 只处理允许的图片文件
-            if not allowed_file(filename):
-                logger.debug(f"跳过不支持的文件类型: {filename}")
-                continue
+def diff_photo_tree(app, manifest, existing_photos):
+    """用 os.scandir 单次遍历照片目录并与清单、照片记录比对
 
-            # 更新进度
-            scan_progress["processed"] += 1
+    existing_photos 的格式见 load_existing_photos。返回 (changes, removed, errors)：
+      changes: 新增或变化的文件 [(分类, 文件名, 路径, 签名, 清单id或None)]
+      removed: 已从磁盘删除的文件 [(分类, 文件名, 清单id或None)]，包括没有清单条目的照片记录
+               （升级前的旧库、迁移清空清单后尚未重新扫描的记录）
+    无法访问的根目录会抛出 FileNotFoundError / PermissionError。
+    """
+    logger = app.logger
+    photo_root = app.config['PHOTO_FOLDER']
+    changes = []
+    seen = set()
+    unreachable = set()
+    errors = 0
 
-            # 检查数据库中是否已存在该照片（使用预先构建的映射）
-            photo_key = f"{category}/{filename}"
-            existing_photo = existing_photos_map.get(photo_key)
+    with os.scandir(photo_root) as root_entries:
+        category_entries = [entry for entry in root_entries
+                            if not entry.name.startswith(('.', '~')) and entry.name != 'thumbnails']
 
-            # 定义缩略图路径
-            thumbnail_path = os.path.join(category_thumb_dir, filename)
+    for category_entry in category_entries:
+        category = category_entry.name
+        try:
+            if not category_entry.is_dir():
+                continue
+            with os.scandir(category_entry.path) as entries:
+                for entry in entries:
+                    filename = entry.name
+
+                    # 跳过隐藏文件和目录，只处理允许的图片文件
+                    if filename.startswith(('.', '~')) or not entry.is_file() or not allowed_file(filename):
+                        continue
+
+                    key = (category, filename)
+                    seen.add(key)
+                    try:
+                        signature = _file_signature(entry)
+                    except OSError as e:
+                        logger.error(f"无法获取文件信息: {entry.path} - {e}")
+                        errors += 1
+                        continue
+
+                    known = manifest.get(key)
+                    if known and known[1:] == signature:
+                        continue
+                    changes.append((category, filename, entry.path, signature, known[0] if known else None))
+        except (PermissionError, NotADirectoryError, FileNotFoundError) as e:
+            logger.error(f"无法访问分类目录 '{category_entry.path}': {e}")
+            errors += 1
+            # 暂时无法访问的分类不视为已删除
+            unreachable.add(category)
+
+    removed = [(category, filename, value[0])
+               for (category, filename), value in manifest.items()
+               if (category, filename) not in seen and category not in unreachable]
+    for category, files in existing_photos.items():
+        if category in unreachable:
+            continue
+        removed.extend((category, filename, None) for filename in files
+                       if (category, filename) not in seen and (category, filename) not in manifest)
+    return changes, removed, errors
 
-            # 生成缩略图（如果不存在，或者原图比缩略图新）
-            need_generate_thumbnail = False
-            thumbnail_generated = False
 
-            if not os.path.exists(thumbnail_path):
-                need_generate_thumbnail = True
-                logger.info(f"缩略图不存在，将生成: {thumbnail_path}")
+def _remove_thumbnail(thumbnail_root, category, thumb_filename):
+    """删除已失效的缩略图及其各格式版本（原图已不存在）"""
+    thumb_path = os.path.join(thumbnail_root, category, thumb_filename)
+    if not os.path.realpath(thumb_path).startswith(os.path.realpath(thumbnail_root)):
+        return
+    for path in [thumb_path] + [variant_path(thumb_path, fmt) for fmt in current_app.config['THUMBNAIL_OUTPUT_FORMATS']]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            current_app.logger.warning(f"删除缩略图失败 ({path}): {str(e)}")
+
+
+def load_existing_photos(keys=None):
+    """读取已有照片的 id：{分类: {文件名: id}}；keys 为 None 时读取全部
+
+    只查询三列并流式读取，不构造 ORM 对象；同一分类的行共用一个分类字符串作为外层键。
+    """
+    existing_photos = {}
+    query = db.session.query(Photo.category, Photo.filename, Photo.id)
+    if keys is not None:
+        # 只读取指定的少量记录（监视器增量索引）
+        for category, filename in keys:
+            row = query.filter(Photo.category == category, Photo.filename == filename).first()
+            if row:
+                existing_photos.setdefault(category, {})[filename] = row[2]
+        return existing_photos
+
+    for category, filename, photo_id in query.execution_options(stream_results=True).yield_per(10000):
+        existing_photos.setdefault(category, {})[filename] = photo_id
+    return existing_photos
+
+
+def index_photo_changes(app, changes, removed, existing_photos, progress, job_id=None):
+    """处理比对结果：移除已删除文件的记录，为新增或变化的文件生成缩略图并写库
+
+    changes / removed 的格式见 diff_photo_tree，existing_photos 的格式见 load_existing_photos；progress 为进度字典（total / processed / committed / batches）。
+    job_id 不为空时，每个检查点把进度写入对应的扫描任务记录，供所有进程查询。
+    已删除文件的记录先单独提交；新增和更新的记录攒成批次，每处理 SCAN_BATCH_SIZE 张用 executemany 写入并提交一次，
+    会话中不保留待提交的 ORM 对象；scan_stop_event 置位时提交已完成部分后返回。
+    数据库错误向上抛出，由调用方回滚。
+    """
+    logger = app.logger
+    thumbnail_root = app.config['THUMBNAIL_FOLDER']
+    shared_root = app.config['THUMBNAIL_SHARED_FOLDER']
+    formats = app.config['THUMBNAIL_OUTPUT_FORMATS']
+    result = {"new": 0, "updated": 0, "removed": 0, "errors": 0, "interrupted": False}
+
+    # 照片删除或内容变化后可能不再被引用的共享缩略图（内容摘要），提交后检查链接数并清理
+    released_hashes = set()
+
+    def release_shared_thumbnails():
+        for digest in released_hashes:
+            release_shared_thumbnail(shared_root, digest, formats)
+        released_hashes.clear()
+
+    # 分类统计（照片数、总大小、封面）随每个批次增量更新
+    stats = CategoryStatsDelta()
+
+    # 当前批次待写入的数据（字典形式，提交后清空）
+    new_photos = []
+    photo_updates = []
+    new_manifest = []
+    manifest_updates = []
+    batch_size = max(1, app.config.get('SCAN_BATCH_SIZE') or 500)
+    last_checkpoint = progress["processed"]
+    progress.setdefault("committed", 0)
+    progress.setdefault("batches", 0)
+
+    def checkpoint(force=False):
+        """写入并提交当前批次（照片记录 + 清单条目），作为扫描中断后的续扫起点"""
+        nonlocal last_checkpoint
+        if not force and progress["processed"] - last_checkpoint < batch_size:
+            return
+        if new_photos:
+            db.session.execute(Photo.__table__.insert(), new_photos)
+        if photo_updates:
+            released_hashes.update(digest for (digest,) in db.session.query(Photo.content_hash).filter(
+                Photo.id.in_([entry['id'] for entry in photo_updates]), Photo.content_hash.isnot(None)))
+            db.session.bulk_update_mappings(Photo, photo_updates)
+        if new_manifest:
+            db.session.execute(PhotoManifest.__table__.insert(), new_manifest)
+        if manifest_updates:
+            stats.files_replaced(entry['id'] for entry in manifest_updates)
+            db.session.bulk_update_mappings(PhotoManifest, manifest_updates)
+        stats.apply()
+        bump_index_generation()
+
+        last_checkpoint = progress["processed"]
+        progress["committed"] = last_checkpoint
+        progress["batches"] += 1
+        if job_id is not None:
+            ScanJob.record_progress(job_id, progress)
+        db.session.commit()
+        release_shared_thumbnails()
+        for pending in (new_photos, photo_updates, new_manifest, manifest_updates):
+            pending.clear()
+        logger.info(f"扫描批次 {progress['batches']} 已提交: {last_checkpoint}/{progress['total']}")
+
+    # 处理已删除的文件：删除数据库记录、缩略图和清单条目
+    removed_photo_ids = []
+    for category, filename, manifest_id in removed:
+        progress["processed"] += 1
+        photo_id = existing_photos.get(category, {}).pop(filename, None)
+        if photo_id is not None:
+            thumb_filename, digest = (db.session.query(Photo.thumbnail, Photo.content_hash)
+                                      .filter(Photo.id == photo_id).first() or (None, None))
+            _remove_thumbnail(thumbnail_root, category, thumb_filename or filename)
+            if digest:
+                released_hashes.add(digest)
+            removed_photo_ids.append(photo_id)
+            if manifest_id is None:
+                stats.recount(category)
             else:
+                stats.photos_removed([category])
+            result["removed"] += 1
+            logger.info(f"原图已删除，移除数据库记录: {category}/{filename}")
+    removed_manifest_ids = [manifest_id for _, _, manifest_id in removed if manifest_id is not None]
+    for start in range(0, max(len(removed_photo_ids), len(removed_manifest_ids)), 500):
+        photo_ids = removed_photo_ids[start:start + 500]
+        manifest_ids = removed_manifest_ids[start:start + 500]
+        if photo_ids:
+            db.session.execute(Photo.__table__.delete().where(Photo.id.in_(photo_ids)))
+        if manifest_ids:
+            stats.files_replaced(manifest_ids)
+            db.session.execute(PhotoManifest.__table__.delete().where(PhotoManifest.id.in_(manifest_ids)))
+
+    # 删除单独作为一个检查点提交：写锁只在这里短暂持有，不延续到后面的缩略图生成
+    # （否则心跳、监视器的写入会在生成第一批缩略图期间等待超时）
+    if removed:
+        checkpoint(force=True)
+
+    def record_manifest(category, filename, signature, manifest_id, failed=False):
+        """文件处理完成后登记到清单，文件不变时下次扫描跳过；failed 表示源文件无法解码，不计入分类统计"""
+        size, mtime_ns, inode = signature
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'inode': inode, 'failed': failed}
+        if not failed:
+            stats.file_added(category, filename, size, mtime_ns)
+        if manifest_id is None:
+            entry.update(category=category, filename=filename)
+            new_manifest.append(entry)
+        else:
+            entry['id'] = manifest_id
+            manifest_updates.append(entry)
+
+    def record_photo(category, filename, existing_id, thumbnail_generated, signature, metadata):
+        """根据处理结果新增或更新数据库记录（只在协调线程中调用）"""
+        # executemany 要求每条记录的键相同，缺失的 EXIF 项写入 NULL
+        fields = dict.fromkeys(METADATA_FIELDS)
+        fields.update(metadata or {})
+        thumb_version = thumbnail_version(signature[0], signature[1], fields['orientation'])
+        if fields['taken_at'] is None:
+            # 没有拍摄时间的照片按文件修改时间参与日期排序
+            fields['taken_at'] = datetime.fromtimestamp(signature[1] / 1e9)
+        # 感知哈希拆成分段字段，供相似照片索引查找
+        fields.update(phash_columns(fields['phash']))
+        if existing_id is not None:
+            # 缩略图版本随原图变化，写入后前端拿到新的缩略图 URL
+            photo_updates.append(dict(fields, id=existing_id, thumbnail=filename, thumb_version=thumb_version))
+            # 如果缩略图是新生成的，计入更新数
+            if thumbnail_generated:
+                result["updated"] += 1
+                logger.debug(f"更新数据库记录: {category}/{filename}")
+        else:
+            # 新增照片记录
+            photo_title = os.path.splitext(filename)[0]
+            new_photos.append(dict(
+                fields,
+                title=photo_title,
+                filename=filename,
+                thumbnail=filename,
+                thumb_version=thumb_version,
+                category=category
+            ))
+            stats.photo_added(category)
+            result["new"] += 1
+            logger.info(f"新增数据库记录: {category}/{filename}")
+
+    def handle_results(results):
+        """处理进程池返回的缩略图和 EXIF 结果：数据库写入和进度更新都留在协调线程"""
+        for tag, ok, error, metadata in results:
+            category, filename, file_path, existing_id, signature, manifest_id, generated = tag
+            progress["processed"] += 1
+            if not ok:
+                result["errors"] += 1
+                logger.error(error)
+                logger.error(f"{'生成缩略图' if generated else '读取照片信息'}失败，跳过文件: {file_path}")
+                if metadata is not None:
+                    # 源文件本身无法解码（损坏、格式不支持）：登记为失败，文件变化前不再重复解码；
+                    # 无法读取、写入失败、子进程崩溃等情况不登记，下次扫描重试
+                    record_manifest(category, filename, signature, manifest_id, failed=True)
+                continue
+            if generated:
+                logger.info(f"已生成/更新缩略图: {os.path.join(thumbnail_root, category, filename)}")
+            record_photo(category, filename, existing_id, generated, signature, metadata)
+            record_manifest(category, filename, signature, manifest_id)
+        checkpoint()
+
+    # 少量文件（监视器增量索引）不值得启动进程池
+    workers = app.config.get('SCAN_WORKERS') or 1
+    if len(changes) < workers:
+        workers = 1
+
+    with ThumbnailPool(workers, app.config['THUMBNAIL_MAX_SIZE'], formats, shared_root=shared_root) as pool:
+        for category, filename, file_path, signature, manifest_id in changes:
+            if scan_stop_event.is_set():
+                result["interrupted"] = True
+                logger.info("收到停止请求，提交已完成的部分后退出扫描")
+                break
+
+            # 检查数据库中是否已存在该照片（使用预先构建的映射）
+            existing_id = existing_photos.get(category, {}).get(filename)
+
+            # 定义缩略图路径（各格式版本为 <缩略图路径>.<扩展名>）
+            thumbnail_path = os.path.join(thumbnail_root, category, filename)
+
+            # 清单中已有记录说明原图发生了变化，必须重新生成；
+            # 清单中没有记录时，已有且不旧于原图的缩略图（以 JPEG 兜底版本为准）可以直接沿用
+            need_generate_thumbnail = True
+            if manifest_id is None:
                 try:
-                    orig_mtime = os.path.getmtime(file_path)
-                    thumb_mtime = os.path.getmtime(thumbnail_path)
-                    if orig_mtime > thumb_mtime:
-                        need_generate_thumbnail = True
-                        logger.info(f"原图已更新，重新生成缩略图: {filename}")
+                    if os.stat(variant_path(thumbnail_path, 'jpeg')).st_mtime_ns >= signature[1]:
+                        need_generate_thumbnail = False
+                except FileNotFoundError:
+                    logger.info(f"缩略图不存在，将生成: {thumbnail_path}")
                 except OSError as e:
-                    logger.error(f"无法获取文件修改时间: {file_path} 或 {thumbnail_path}, {e}")
-                    need_generate_thumbnail = True
+                    logger.error(f"无法获取缩略图修改时间: {thumbnail_path}, {e}")
+            else:
+                logger.info(f"原图已更新，重新生成缩略图: {filename}")
 
-            if need_generate_thumbnail:
-                if create_thumbnail(file_path, thumbnail_path):
-                    thumbnail_generated = True
-                    logger.info(f"已生成/更新缩略图: {thumbnail_path}")
-                else:
-                    error_count += 1
-                    logger.error(f"生成缩略图失败，跳过文件: {file_path}")
-                    continue
+            # 交给进程池（EXIF 与缩略图在同一次解码中读取；缩略图可沿用或已有相同内容的共享缩略图时只读文件头），
+            # 完成后在 handle_results 中计入进度并写库
+            tag = (category, filename, file_path, existing_id, signature, manifest_id, need_generate_thumbnail)
+            handle_results(pool.submit(tag, file_path, thumbnail_path, render=need_generate_thumbnail))
 
-            if existing_photo:
-                # 如果缩略图是新生成的，更新数据库记录
-                if thumbnail_generated:
-                    existing_photo.thumbnail = filename
-                    update_count += 1
-                    logger.debug(f"更新数据库记录: {category}/{filename}")
-            else:
-                # 新增照片记录
-                photo_title = os.path.splitext(filename)[0]
-                new_photo = Photo(
-                    title=photo_title,
-                    filename=filename,
-                    thumbnail=filename,
-                    category=category
-                )
-                db.session.add(new_photo)
-                new_count += 1
-                logger.info(f"新增数据库记录: {category}/{filename}")
-                # 添加到映射中避免重复添加
-                existing_photos_map[photo_key] = new_photo
+        # 等待剩余的缩略图任务（中断时也把已提交的任务处理完）
+        handle_results(pool.drain())
+
+    checkpoint(force=True)
+    return result
+
+
+def scan_photo_folder(app, job_id=None):
+    """增量扫描照片目录：与清单比对，只为新增、变化、删除的文件生成缩略图并更新数据库
+
+    job_id 为当前扫描任务（见 run_scan_job），进度写入任务记录。
+    返回结果字典，其中 state 为 complete / interrupted / failed。
+    """
+    logger = app.logger
+
+    # 确保缩略图根目录存在
+    os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+
+    scan_progress = {"total": 0, "processed": 0, "committed": 0, "batches": 0}
 
+    # 单次遍历目录树并与清单、照片记录比对
+    manifest = load_manifest()
+    existing_photos = load_existing_photos()
     try:
+        changes, removed, walk_errors = diff_photo_tree(app, manifest, existing_photos)
+    except (FileNotFoundError, PermissionError) as e:
+        photo_root = app.config['PHOTO_FOLDER']
+        logger.error(f"无法访问照片根目录: {photo_root} - {str(e)}")
+        return {"message": f"错误：无法访问照片根目录 '{photo_root}'", "state": "failed",
+                "new": 0, "updated": 0, "removed": 0, "errors": 1}
+    logger.info(f"清单比对完成：共 {len(manifest)} 条记录，{len(changes)} 个新增或变化，{len(removed)} 个已删除")
+    del manifest
+
+    scan_progress["total"] = len(changes) + len(removed)
+    if not changes and not removed:
+        return {"message": "扫描完成，照片目录没有变化", "state": "complete",
+                "new": 0, "updated": 0, "removed": 0, "errors": walk_errors}
+    logger.info(f"开始扫描，共 {scan_progress['total']} 张照片需要处理")
+    logger.info(f"缩略图生成进程数: {app.config.get('SCAN_WORKERS') or 1}")
+
+    # 中途被终止时，已提交的检查点与清单一致，下次扫描只处理剩余文件
+    if job_id is not None:
+        ScanJob.record_progress(job_id, scan_progress)
         db.session.commit()
-        result_msg = f"扫描完成，新增 {new_count} 张照片，更新 {update_count} 张照片记录，遇到 {error_count} 个错误"
-        return {
-            "message": result_msg,
-            "new": new_count,
-            "updated": update_count,
-            "errors": error_count
-        }
-    except Exception as e:
+
+    try:
+        result = index_photo_changes(app, changes, removed, existing_photos, scan_progress, job_id=job_id)
+    except SQLAlchemyError as e:
+        # 其他异常（程序错误）交给 run_scan_job 记录详细错误并把任务标记为失败
         db.session.rollback()
         logger.error(f"数据库提交失败: {str(e)}")
         return {
             "message": f"扫描失败（数据库错误）: {str(e)}",
+            "state": "failed",
             "new": 0,
             "updated": 0,
-            "errors": error_count + 1
+            "removed": 0,
+            "errors": walk_errors + 1
         }
 
+    error_count = walk_errors + result["errors"]
+    if result["interrupted"]:
+        result_msg = (f"扫描已中断，已保存 {scan_progress['processed']}/{scan_progress['total']} 张照片的进度，"
+                      f"下次扫描将从检查点继续")
+    else:
+        result_msg = (f"扫描完成，新增 {result['new']} 张照片，更新 {result['updated']} 张照片记录，"
+                      f"移除 {result['removed']} 张照片记录，遇到 {error_count} 个错误")
+    return {
+        "message": result_msg,
+        "state": "interrupted" if result["interrupted"] else "complete",
+        "new": result["new"],
+        "updated": result["updated"],
+        "removed": result["removed"],
+        "errors": error_count
+    }
+
+
+def diff_photo_paths(app, keys):
+    """比对指定文件（监视器上报的变化）与清单，返回格式与 diff_photo_tree 相同的 (changes, removed)"""
+    photo_root = app.config['PHOTO_FOLDER']
+    changes = []
+    removed = []
+    for category, filename in keys:
+        known = db.session.query(
+            PhotoManifest.id, PhotoManifest.size, PhotoManifest.mtime_ns, PhotoManifest.inode
+        ).filter_by(category=category, filename=filename).first()
+        file_path = os.path.join(photo_root, category, filename)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            st = None
+        except OSError as e:
+            app.logger.error(f"无法获取文件信息: {file_path} - {e}")
+            continue
+        if st is None or not stat.S_ISREG(st.st_mode):
+            # 没有清单条目时照片记录也可能存在，交给 index_photo_changes 按记录删除
+            removed.append((category, filename, known[0] if known else None))
+            continue
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        if known and tuple(known[1:]) == signature:
+            continue
+        changes.append((category, filename, file_path, signature, known[0] if known else None))
+    return changes, removed
+
+
+def expand_category_changes(app, category):
+    """分类目录整体变化（新建、删除、改名）时，展开为该分类下所有需要比对的文件"""
+    keys = {(category, filename) for (filename,) in
+            db.session.query(PhotoManifest.filename).filter_by(category=category)}
+    keys.update((category, filename) for (filename,) in
+                db.session.query(Photo.filename).filter_by(category=category))
+    category_path = os.path.join(app.config['PHOTO_FOLDER'], category)
+    try:
+        with os.scandir(category_path) as entries:
+            for entry in entries:
+                if not entry.name.startswith(('.', '~')) and entry.is_file():
+                    keys.add((category, entry.name))
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    except PermissionError as e:
+        app.logger.error(f"无法访问分类目录 '{category_path}': {e}")
+    return keys
+
+
+def apply_watched_changes(app, events):
+    """监视器回调：对上报的文件做增量索引
+
+    events 为 {(分类, 文件名)}；文件名为 None 表示整个分类目录变化，
+    (None, None) 表示事件队列溢出，退回一次完整的增量扫描。
+    返回 False 表示当前有全量扫描在进行，事件应保留到下一轮。
+    """
+    if (None, None) in events:
+        app.logger.info("监视器事件溢出，执行一次完整的增量扫描")
+        return run_scan_job(app) is not None
+
+    with app.app_context():
+        try:
+            if active_scan_job():
+                return False
+            keys = set()
+            for category, filename in events:
+                if category.startswith(('.', '~')) or category == 'thumbnails':
+                    continue
+                if filename is None:
+                    keys |= expand_category_changes(app, category)
+                elif not filename.startswith(('.', '~')) and allowed_file(filename):
+                    keys.add((category, filename))
+            changes, removed = diff_photo_paths(app, sorted(keys))
+            if not changes and not removed:
+                return True
+
+            progress = {"total": len(changes) + len(removed), "processed": 0}
+            existing = load_existing_photos([(c, f) for c, f, *_ in changes] + [(c, f) for c, f, _ in removed])
+            result = index_photo_changes(app, changes, removed, existing, progress)
+            app.logger.info(f"增量索引完成：新增 {result['new']}，更新 {result['updated']}，"
+                            f"移除 {result['removed']}，错误 {result['errors']}")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"增量索引失败: {str(e)}")
+        finally:
+            db.session.remove()
+    return True
+
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     config_class.init_app(app)
+    # 实际输出的缩略图格式（去掉当前 Pillow 不支持编码的格式）
+    app.config['THUMBNAIL_OUTPUT_FORMATS'] = supported_formats(app.config['THUMBNAIL_FORMATS'])
 
     # <<< 日志到位：清理默认 handler，改成 stdout + INFO（不带时间戳） >>>
     app.logger.handlers.clear()
@@ -302,15 +822,21 @@ def create_app(config_class=Config):
     db.init_app(app)
     CSRFProtect(app)
 
-    # 创建数据库表
+    # 创建数据库表（多进程同时启动时由迁移锁保证只有一个进程执行迁移）
     with app.app_context():
         try:
             app.logger.info("数据库初始化...")
-            db.drop_all()   # 删除所有表
-            db.create_all()   # 重新建表
-            app.logger.info("数据库表创建成功")
+            with InterProcessLock(app.config['MIGRATION_LOCK_FILE']):
+                version = upgrade_database(app)
+            app.logger.info(f"数据库表已就绪（结构版本 {version}）")
+            app.config['SEARCH_TOKENIZER'] = detect_tokenizer(db.session)
+            if not app.config['SEARCH_TOKENIZER']:
+                app.logger.warning("SQLite 不支持 FTS5，三个字以上的检索词将使用 LIKE 匹配")
+            last_job = ScanJob.latest()
+            if last_job and last_job.state in ('running', 'interrupted'):
+                app.logger.info("上次扫描未完成，本次扫描将从检查点继续")
         except Exception as e:
-            app.logger.error(f"数据库表创建失败: {str(e)}")
+            app.logger.error(f"数据库初始化失败: {str(e)}")
 
     # ------------------------------
     # 路由定义
@@ -327,10 +853,8 @@ def create_app(config_class=Config):
         if not allowed_file(filename):
             return jsonify({'error': '不支持的文件类型'}), 400
 
-        response = send_from_directory(category_path, filename)
-        # 设置缓存头 - 图片资源可缓存1小时
-        response.headers['Cache-Control'] = 'public, max-age=3600'
-        return response
+        # 设置缓存头 - 图片资源可缓存1小时，过期后凭 ETag 重新验证
+        return send_cached_file(category_path, filename, 'public, max-age=3600')
 
     @app.route('/thumbnails/<category>/<filename>')
     def thumbnail_file(category, filename):
@@ -349,24 +873,227 @@ def create_app(config_class=Config):
         if not real_path.startswith(os.path.realpath(app.config['THUMBNAIL_FOLDER'])):
             return jsonify({'error': '访问越界'}), 403
 
-        return send_from_directory(thumb_category_path, filename)
+        # 按 Accept 头选择 AVIF / WebP / JPEG 版本
+        thumb_path, mimetype = find_thumbnail_variant(
+            os.path.join(thumb_category_path, filename), app.config['THUMBNAIL_OUTPUT_FORMATS']
+        )
+        if not thumb_path:
+            return jsonify({'error': '资源未找到'}), 404
 
-    @app.route('/api/photos', methods=['GET'])
-    def get_photos():
-        if db_lock.locked() or not is_scanning_event.is_set():
-            return jsonify({'error': '数据库正在更新（扫描照片），暂时无法获取照片'}), 503
+        # 带版本号（?v=，见 Photo.to_dict）的 URL 内容不会变化，可长期缓存；不带版本号的每次重新验证
+        if request.args.get('v'):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'public, no-cache'
+        return send_cached_file(thumb_category_path, os.path.basename(thumb_path), cache_control,
+                                mimetype=mimetype, vary='Accept')
+
+    derivative_cache = DerivativeCache(app.config['DERIVATIVE_FOLDER'], app.config['DERIVATIVE_CACHE_MAX_BYTES'])
+
+    @app.route('/thumbnails/<int:size>/<category>/<filename>')
+    def derivative_file(size, category, filename):
+        """按需生成并缓存指定宽度的衍生图（查看大图时代替原图）"""
+        if size not in app.config['DERIVATIVE_WIDTHS']:
+            return jsonify({'error': '不支持的尺寸'}), 404
+        if '..' in category or category.startswith(('.', '~')) or '/' in category or '\\' in category:
+            return jsonify({'error': '无效的路径'}), 400
+        if not allowed_file(filename):
+            return jsonify({'error': '不支持的文件类型'}), 400
+
+        src_path = os.path.join(app.config['PHOTO_FOLDER'], category, filename)
+        if not os.path.isfile(src_path):
+            return jsonify({'error': '资源未找到'}), 404
+
+        # 按 Accept 头选择输出格式；多个并发请求同一张未缓存的图只会触发一次缩放
+        fmt = accepted_format(app.config['THUMBNAIL_OUTPUT_FORMATS'])
+        derivative_path = derivative_cache.get(size, src_path, category, filename, fmt)
+        if not derivative_path:
+            return jsonify({'error': '生成缩略图失败'}), 500
+
+        if request.args.get('v'):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'public, no-cache'
+        return send_cached_file(os.path.dirname(derivative_path), os.path.basename(derivative_path), cache_control,
+                                mimetype=thumbnail_mimetype(fmt), vary='Accept')
+
+    @app.route('/sprites/<digest>.jpg')
+    def sprite_file(digest):
+        """按需生成并缓存一页缩略图的雪碧图（ids 为页面中照片的顺序，见 /api/photos?sprite=1）"""
+        try:
+            ids = [int(value) for value in request.args.get('ids', '').split(',')]
+        except ValueError:
+            return jsonify({'error': '无效的照片列表'}), 400
+        if not ids or len(ids) > MAX_PER_PAGE:
+            return jsonify({'error': '无效的照片列表'}), 400
+
+        photos = {photo.id: photo for photo in Photo.query.filter(Photo.id.in_(ids))}
+        ordered = [photos.get(photo_id) for photo_id in ids]
+        thumbnail_root = os.path.realpath(app.config['THUMBNAIL_FOLDER'])
+        tile_paths = []
+        for photo in ordered:
+            path = None
+            if photo is not None:
+                path = os.path.realpath(variant_path(
+                    os.path.join(thumbnail_root, photo.category, photo.thumbnail or photo.filename), 'jpeg'))
+                if not path.startswith(thumbnail_root + os.sep):
+                    path = None
+            tile_paths.append(path)
+
+        # 按当前内容计算摘要：照片已变化时生成新图，旧地址不再长期缓存
+        tile_size = tuple(app.config['SPRITE_TILE_SIZE'])
+        current = sprite_digest([(photo_id, photos[photo_id].thumb_version if photo_id in photos else '-')
+                                 for photo_id in ids], tile_size)
+        sprite_path = derivative_cache.get_sprite(current, tile_paths, tile_size, app.config['SPRITE_COLUMNS'])
+        if not sprite_path:
+            return jsonify({'error': '生成雪碧图失败'}), 500
+
+        if current == digest:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'public, no-cache'
+        return send_cached_file(os.path.dirname(sprite_path), os.path.basename(sprite_path), cache_control,
+                                mimetype='image/jpeg')
 
-        query = Photo.query
+    # 序列化好的 /api/photos、/api/categories 响应，索引版本号变化（扫描提交）后失效
+    response_cache = ResponseCache(app.config['API_CACHE_MAX_ENTRIES'], app.config['API_CACHE_TTL'])
 
+    @app.route('/api/photos', methods=['GET'])
+    def get_photos():
         category = request.args.get('category')
-        if category and category != 'all':
-            query = query.filter_by(category=category)
+        if not category or category == 'all':
+            category = None
+
+        # 检索词：匹配标题和描述，结果按相关度排序、按页码分页
+        q = (request.args.get('q') or '').strip()[:MAX_QUERY_LENGTH]
 
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 12, type=int)
+        per_page = max(1, min(per_page or 12, MAX_PER_PAGE))
+
+        # 排序：filename（默认）或 taken_at（拍摄时间，order=desc 时从新到旧）；检索时按相关度排序
+        sort = request.args.get('sort', 'filename')
+        if sort not in ('filename', 'taken_at'):
+            return jsonify({'error': '无效的排序方式'}), 400
+        descending = sort == 'taken_at' and request.args.get('order') == 'desc'
+
+        # 拍摄时间范围 [from, to]，走 (category, taken_at, id) / (taken_at, id) 索引
+        try:
+            taken_from = parse_date_param(request.args.get('from'))
+            taken_to = parse_date_param(request.args.get('to'), end=True)
+        except ValueError:
+            return jsonify({'error': '无效的日期参数'}), 400
+        date_filtered = taken_from is not None or taken_to is not None
+
+        # sprite=1：同时返回本页缩略图雪碧图的地址和每张照片的坐标（检索结果不支持）
+        sprite = request.args.get('sprite') in ('1', 'true')
+
+        # 键集游标：after=<排序键,id>，深翻页与第一页代价相同
+        after = None if q else request.args.get('after')
+        cursor = None
+        if after:
+            cursor = parse_photo_cursor(after, sort)
+            if cursor is None:
+                return jsonify({'error': '无效的分页游标'}), 400
+
+        def build():
+            nonlocal page
+            query = Photo.query
+            if category:
+                query = query.filter_by(category=category)
+            if date_filtered or sort == 'taken_at':
+                query = query.filter(Photo.taken_at.isnot(None))
+            if taken_from is not None:
+                query = query.filter(Photo.taken_at >= taken_from)
+            if taken_to is not None:
+                query = query.filter(Photo.taken_at < taken_to)
+
+            if q:
+                return build_search(query)
+
+            if date_filtered:
+                # 日期范围内的计数只扫描拍摄时间索引的对应区间
+                total_photos = query.with_entities(func.count(Photo.id)).scalar() or 0
+            else:
+                total_photos = count_photos(category)
+            total_pages = (total_photos + per_page - 1) // per_page
+            page = max(1, min(page, total_pages)) if total_pages > 0 else 1
+
+            if sort == 'taken_at':
+                key_column = Photo.taken_at
+                if descending:
+                    query = query.order_by(Photo.taken_at.desc(), Photo.id.desc())
+                else:
+                    query = query.order_by(Photo.taken_at, Photo.id)
+            else:
+                key_column = Photo.filename
+                query = query.order_by(Photo.filename, Photo.id)
+            if cursor:
+                after_key, after_id = cursor
+                if descending:
+                    query = query.filter(or_(
+                        key_column < after_key,
+                        and_(key_column == after_key, Photo.id < after_id)
+                    ))
+                else:
+                    query = query.filter(or_(
+                        key_column > after_key,
+                        and_(key_column == after_key, Photo.id > after_id)
+                    ))
+            else:
+                query = query.offset((page - 1) * per_page)
+            current_photos = query.limit(per_page).all()
+
+            next_cursor = (make_photo_cursor(current_photos[-1], sort)
+                           if len(current_photos) == per_page else None)
+            payload = {
+                'photos': [photo.to_dict() for photo in current_photos],
+                'total': total_photos,
+                'pages': total_pages,
+                'current_page': page,
+                'per_page': per_page,
+                'sort': sort,
+                'order': 'desc' if descending else 'asc',
+                'next_cursor': next_cursor
+            }
+            if sprite and current_photos:
+                # 批量模式：整页缩略图拼成一张雪碧图，一个请求代替每张缩略图各一个请求
+                payload['sprite'], rects = sprite_manifest(current_photos)
+                for photo_dict, rect in zip(payload['photos'], rects):
+                    photo_dict['sprite_rect'] = rect
+            return payload
+
+        def build_search(query):
+            nonlocal page
+            query, indexed = apply_search(query, Photo, q, app.config.get('SEARCH_TOKENIZER'))
+            # 常见检索词可能命中大量照片，计数到上限为止
+            limited = query.with_entities(Photo.id).limit(SEARCH_COUNT_LIMIT).subquery()
+            total_photos = db.session.query(func.count()).select_from(limited).scalar() or 0
+            total_pages = (total_photos + per_page - 1) // per_page
+            page = max(1, min(page, total_pages)) if total_pages > 0 else 1
+
+            if indexed:
+                query = order_search(query, Photo, total_photos, indexed)
+            else:
+                query = query.order_by(Photo.filename, Photo.id)
+            current_photos = query.offset((page - 1) * per_page).limit(per_page).all()
+            return {
+                'photos': [photo.to_dict() for photo in current_photos],
+                'total': total_photos,
+                'total_is_limited': total_photos >= SEARCH_COUNT_LIMIT,
+                'pages': total_pages,
+                'current_page': page,
+                'per_page': per_page,
+                'next_cursor': None,
+                'q': q
+            }
 
         try:
-            photos = query.order_by(Photo.filename).all()
+            # 扫描期间照常返回已提交的索引，通过响应头告知前端扫描仍在进行
+            scanning = active_scan_job() is not None
+            cache_key = ('photos', category, page, per_page, after, q, sort, descending, taken_from, taken_to,
+                         sprite)
+            response = cached_json_response(response_cache, cache_key, build)
         except Exception as e:
             app.logger.error(f"照片查询失败: {str(e)}", exc_info=True)
             return jsonify({
@@ -374,43 +1101,128 @@ def create_app(config_class=Config):
                 'details': str(e) if app.debug else '请查看服务器日志'
             }), 500
 
-        total_photos = len(photos)
-        total_pages = (total_photos + per_page - 1) // per_page
-        page = max(1, min(page, total_pages)) if total_pages > 0 else 1
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        current_photos = photos[start_idx:end_idx]
+        if scanning:
+            response.headers['X-Scan-In-Progress'] = '1'
+        return response
 
-        return jsonify({
-            'photos': [photo.to_dict() for photo in current_photos],
-            'total': total_photos,
-            'pages': total_pages,
-            'current_page': page,
-            'per_page': per_page
-        })
+    @app.route('/api/photos/<int:photo_id>/similar', methods=['GET'])
+    def get_similar_photos(photo_id):
+        """相似照片（连拍、重新导出等）：感知哈希汉明距离不超过 max_distance 的照片，按距离排序"""
+        max_distance = request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int)
+        max_distance = max(0, min(max_distance, MAX_DISTANCE))
+        limit = request.args.get('limit', 20, type=int)
+        limit = max(1, min(limit or 20, MAX_PER_PAGE))
+
+        def build():
+            photo = db.session.get(Photo, photo_id)
+            matches = []
+            if photo.phash is not None:
+                # 分段索引取出候选（只读 id 和哈希），只对候选计算完整的汉明距离，再读取入选的照片
+                candidates = (db.session.query(Photo.id, Photo.phash)
+                              .filter(similar_condition(Photo, photo.phash, max_distance), Photo.id != photo.id))
+                ranked = rank_similar(candidates, photo.phash, max_distance, limit)
+                photos = {p.id: p for p in Photo.query.filter(Photo.id.in_([pid for _, pid in ranked]))}
+                matches = [(distance, photos[pid]) for distance, pid in ranked if pid in photos]
+            return {
+                'photo': photo.to_dict(),
+                'indexed': photo.phash is not None,  # 尚未计算感知哈希（等待扫描）时为 False
+                'max_distance': max_distance,
+                'similar': [dict(match.to_dict(), distance=distance) for distance, match in matches]
+            }
+
+        try:
+            if db.session.query(Photo.id).filter(Photo.id == photo_id).scalar() is None:
+                return jsonify({'error': '照片不存在'}), 404
+            return cached_json_response(response_cache, ('similar', photo_id, max_distance, limit), build)
+        except Exception as e:
+            app.logger.error(f"相似照片查询失败: {str(e)}", exc_info=True)
+            return jsonify({'error': '获取相似照片失败'}), 500
+
+    @app.route('/api/duplicates', methods=['GET'])
+    def get_duplicates():
+        """重复照片报告：内容摘要相同的照片分为一组，按副本数从多到少分页"""
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        per_page = max(1, min(per_page or 20, MAX_PER_PAGE))
+
+        def build():
+            nonlocal page
+            # 按 ix_photos_content_hash 分组，原图大小取自扫描清单
+            groups = (db.session.query(Photo.content_hash.label('content_hash'),
+                                       func.count(Photo.id).label('copies'),
+                                       func.max(PhotoManifest.size).label('size'))
+                      .outerjoin(PhotoManifest, and_(PhotoManifest.category == Photo.category,
+                                                     PhotoManifest.filename == Photo.filename))
+                      .filter(Photo.content_hash.isnot(None))
+                      .group_by(Photo.content_hash)
+                      .having(func.count(Photo.id) > 1)
+                      .subquery())
+            total_groups, extra_copies, duplicate_bytes = db.session.query(
+                func.count(), func.sum(groups.c.copies - 1), func.sum(groups.c.size * (groups.c.copies - 1))
+            ).one()
+            total_pages = (total_groups + per_page - 1) // per_page
+            page = max(1, min(page, total_pages)) if total_pages > 0 else 1
+
+            rows = (db.session.query(groups.c.content_hash, groups.c.copies, groups.c.size)
+                    .order_by(groups.c.copies.desc(), groups.c.content_hash)
+                    .offset((page - 1) * per_page).limit(per_page).all())
+            members = {}
+            if rows:
+                for photo in (Photo.query.filter(Photo.content_hash.in_([row[0] for row in rows]))
+                              .order_by(Photo.category, Photo.filename)):
+                    members.setdefault(photo.content_hash, []).append(photo.to_dict())
+            return {
+                'groups': [{'content_hash': digest, 'copies': copies, 'size': size, 'photos': members.get(digest, [])}
+                           for digest, copies, size in rows],
+                'total_groups': total_groups,
+                'duplicate_photos': extra_copies or 0,  # 除每组保留一张外的多余副本数
+                'duplicate_bytes': duplicate_bytes or 0,  # 多余副本占用的原图空间
+                'pages': total_pages,
+                'current_page': page,
+                'per_page': per_page
+            }
+
+        try:
+            return cached_json_response(response_cache, ('duplicates', page, per_page), build)
+        except Exception as e:
+            app.logger.error(f"重复照片查询失败: {str(e)}", exc_info=True)
+            return jsonify({'error': '获取重复照片失败'}), 500
 
     @app.route('/api/categories', methods=['GET'])
     def get_categories():
         try:
-            categories = db.session.query(Photo.category).distinct().all()
-            return jsonify({
-                'categories': [c[0] for c in categories if c[0]]
-            })
+            def build():
+                stats = [c for c in list_categories() if c.category]
+                return {
+                    'categories': [c.category for c in stats],
+                    'counts': {c.category: c.photo_count for c in stats},
+                    'stats': [c.to_dict() for c in stats]
+                }
+
+            return cached_json_response(response_cache, ('categories',), build)
         except Exception as e:
             app.logger.error(f"分类查询失败: {str(e)}")
             return jsonify({'error': '获取分类失败'}), 500
 
     @app.route('/api/health', methods=['GET'])
     def health_check():
-        scan_finished = is_scanning_event.is_set()
+        scan_finished = True
+        progress = {}
+        last_job = None
         db_ready = False
         photo_count = 0
         status_message = "数据库未就绪"
 
         try:
-            photo_count = Photo.query.count()
+            photo_count = count_photos()
             db_ready = True
             status_message = f"共{photo_count}张照片"
+            # 扫描状态来自共享的任务记录，无论哪个进程响应结果都一致
+            job = active_scan_job()
+            if job:
+                scan_finished = False
+                progress = job.progress_dict()
+            last_job = job or ScanJob.latest()
         except Exception as e:
             app.logger.warning(f"数据库健康检查失败: {str(e)}")
 
@@ -420,7 +1232,8 @@ def create_app(config_class=Config):
             'scan_finished': scan_finished,
             'db_ready': db_ready,
             'message': status_message,
-            'scan_progress': scan_progress if not scan_finished else {}
+            'scan_progress': progress,
+            'scan_job': last_job.to_dict() if last_job else None
         })
 
     @app.errorhandler(404)
@@ -444,18 +1257,8 @@ def make_handle_termination(app):
         global server_running
         server_running = False
 
-        # 等待扫描完成（最多10秒）
-        if not is_scanning_event.is_set():
-            logger.info("等待当前扫描完成...")
-            is_scanning_event.wait(10)
-
-        # 释放数据库锁
-        if db_lock.locked():
-            logger.info("释放数据库锁...")
-            try:
-                db_lock.release()
-            except Exception as e:
-                logger.warning(f"释放数据库锁失败: {str(e)}")
+        # 通知扫描在下一个检查点提交并退出，停止目录监视（最多等待10秒）
+        stop_background_tasks(app)
 
         # 关闭数据库连接（进入 app 上下文更安全）
         with app.app_context():
@@ -469,38 +1272,137 @@ def make_handle_termination(app):
     return _handle
 
 
-# 自动扫描逻辑 - 移除延迟，立即开始扫描
-def auto_scan_after_start(app):
-    try:
+def _scan_heartbeat(app, job_id, stop_event):
+    """扫描进行期间定期刷新任务心跳（目录比对、大批次缩略图生成时检查点间隔可能较长）"""
+    interval = app.config['SCAN_HEARTBEAT_INTERVAL']
+    while not stop_event.wait(interval):
         with app.app_context():
-            if db_lock.acquire(blocking=False):
-                try:
-                    is_scanning_event.clear()
-                    app.logger.info("后端启动完成，立即开始扫描照片...")
+            try:
+                ScanJob.heartbeat(job_id)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f"刷新扫描任务心跳失败: {str(e)}")
+            finally:
+                db.session.remove()
 
-                    scan_result = scan_photo_folder(app)
-                    app.logger.info(f"扫描结果: {scan_result['message']}")
 
-                except Exception as e:
-                    app.logger.error(f"扫描失败: {str(e)}")
-                    # 记录详细错误信息
-                    import traceback
-                    app.logger.error(f"详细错误: {traceback.format_exc()}")
-                finally:
-                    is_scanning_event.set()
-                    db_lock.release()
-                    app.logger.info("数据库锁已释放，API可正常访问")
-            else:
-                app.logger.warning("获取数据库锁失败，扫描已在进行中")
+def run_scan_job(app):
+    """创建扫描任务并执行一次完整的增量扫描，返回任务 id
+
+    所有进程共用 scan_jobs 表：已有进行中的任务时不重复扫描，返回 None。
+    """
+    with app.app_context():
+        job_id = ScanJob.claim(scan_job_owner(), app.config['SCAN_JOB_STALE_AFTER'])
+        if job_id is None:
+            app.logger.warning("扫描已在进行中，跳过本次扫描")
+            return None
+
+        heartbeat_stop = threading.Event()
+        threading.Thread(target=_scan_heartbeat, args=(app, job_id, heartbeat_stop),
+                         name='scan-heartbeat', daemon=True).start()
+        scan_result = {"message": "扫描失败", "state": "failed", "errors": 1}
+        try:
+            app.logger.info(f"开始扫描照片（任务 {job_id}）...")
+            scan_result = scan_photo_folder(app, job_id)
+            app.logger.info(f"扫描结果: {scan_result['message']}")
+        except Exception as e:
+            db.session.rollback()
+            scan_result["message"] = f"扫描失败: {str(e)}"
+            app.logger.error(f"扫描失败: {str(e)}")
+            # 记录详细错误信息
+            import traceback
+            app.logger.error(f"详细错误: {traceback.format_exc()}")
+        finally:
+            heartbeat_stop.set()
+            try:
+                ScanJob.finish(job_id, scan_result["state"], scan_result)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"记录扫描任务结果失败: {str(e)}")
+            db.session.remove()
+        return job_id
+
+
+# 自动扫描逻辑 - 移除延迟，立即开始扫描
+def auto_scan_after_start(app):
+    try:
+        app.logger.info("后端启动完成，立即开始扫描照片...")
+        run_scan_job(app)
     except Exception as e:
         app.logger.error(f"扫描线程异常: {str(e)}")
-        # 确保异常情况下也能设置事件和释放锁
-        is_scanning_event.set()
-        if db_lock.locked():
-            try:
-                db_lock.release()
-            except Exception:
-                pass
+
+
+def start_background_tasks(app):
+    """启动后台任务：启动扫描线程和照片目录监视线程
+
+    多进程部署（每个 worker 各自调用）时，只有获得后台任务锁的进程会启动，其余进程只处理请求。
+    持有锁的进程退出后锁自动释放，之后新启动的进程接手。返回本进程是否负责后台任务。
+    """
+    global background_lock, scan_thread
+    if background_lock is None:
+        background_lock = InterProcessLock(app.config['BACKGROUND_LOCK_FILE'])
+    if not background_lock.acquire(blocking=False):
+        app.logger.info(f"扫描和目录监视由其他进程负责，进程 {os.getpid()} 只处理请求")
+        return False
+
+    app.logger.info(f"进程 {os.getpid()} 负责启动扫描和照片目录监视")
+    # 上一个持锁进程被强制结束时（kill -9、worker 超时）留下的 running 任务不会再有心跳，
+    # 立即标记为 abandoned，否则启动扫描要等到心跳超时才能开始
+    with app.app_context():
+        try:
+            abandoned = ScanJob.abandon_others(scan_job_owner())
+            if abandoned:
+                app.logger.info(f"上次扫描进程已退出，已将 {abandoned} 个未结束的扫描任务标记为中止")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"清理未结束的扫描任务失败: {str(e)}")
+        finally:
+            db.session.remove()
+
+    scan_thread = threading.Thread(
+        target=auto_scan_after_start,
+        args=(app,),
+        name='startup-scan',
+        daemon=True
+    )
+    scan_thread.start()
+
+    # 启动照片目录监视线程（全量扫描进行中时，监视到的变化会延后处理）
+    start_photo_watcher(app)
+    return True
+
+
+def stop_background_tasks(app, timeout=10):
+    """通知扫描在下一个检查点提交并退出，停止目录监视，最多等待 timeout 秒
+
+    后台任务锁不主动释放：扫描可能仍未退出，由进程退出时自动释放。
+    """
+    scan_stop_event.set()
+    if photo_watcher:
+        photo_watcher.stop()
+
+    # 扫描可能在启动扫描线程中，也可能是监视线程触发的完整扫描
+    deadline = time.monotonic() + timeout
+    for thread in (scan_thread, photo_watcher):
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            app.logger.info(f"等待 {thread.name} 线程结束...")
+            thread.join(max(0, deadline - time.monotonic()))
+
+
+def start_photo_watcher(app):
+    """启动照片目录监视线程，新增、修改、删除的照片无需重启即可被索引"""
+    global photo_watcher
+    if not app.config.get('WATCH_PHOTO_FOLDER'):
+        return None
+    photo_watcher = PhotoWatcher(
+        app.config['PHOTO_FOLDER'],
+        lambda events: apply_watched_changes(app, events),
+        delay=app.config['AUTO_SCAN_DELAY'],
+        poll_interval=app.config['WATCH_POLL_INTERVAL'],
+        log=app.logger
+    )
+    photo_watcher.start()
+    return photo_watcher
 
 
 if __name__ == '__main__':
@@ -530,15 +1432,10 @@ if __name__ == '__main__':
     except Exception as e:
         app.logger.error(f"信号处理初始化失败: {str(e)}")
 
-    # 启动自动扫描线程 - 立即开始扫描
-    scan_thread = threading.Thread(
-        target=auto_scan_after_start,
-        args=(app,),
-        daemon=True
-    )
-    scan_thread.start()
+    # 启动扫描和照片目录监视（已有其他进程负责时跳过）
+    start_background_tasks(app)
 
-    # 启动服务
+    # 启动开发服务器（生产环境请使用 wsgi.py）
     try:
         from werkzeug.serving import make_server
 
@@ -0,0 +1,156 @@
+"""扫描前“已有照片映射”的加载基准：OFFSET 分页加载 ORM 对象 vs 流式列查询
+
+用法：
+    python benchmarks/bench_existing_map.py                 # 1M 行
+    python benchmarks/bench_existing_map.py --rows 200000
+
+旧做法为 Photo.query.offset(offset).limit(1000) 循环，映射中保存完整 ORM 对象；
+新做法为 load_existing_photos 的单条流式查询，只保存 {分类: {文件名: id}}。
+两种做法分别在独立子进程中运行，报告加载耗时、映射常驻内存（tracemalloc）和进程峰值 RSS。
+
+1M 行实测（SQLite 3、SQLAlchemy 1.4）：
+    加载方式              耗时s     映射MB    分配峰值MB   峰值RSS MB
+    offset-orm            71.23    1345.0      1345.1      3508.9
+    streamed-columns      16.13     112.6       117.8       365.8
+旧做法每行构造并常驻一个 ORM 对象，1M 行时进程峰值 RSS 约 3.5GB；新做法耗时约为其 1/4.4，峰值 RSS 约为其 1/10。
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy.orm import declarative_base, Session
+
+Base = declarative_base()
+
+
+class Photo(Base):
+    """与 models.Photo 相同的表结构（不依赖 Flask）"""
+    __tablename__ = 'photos'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String(255), nullable=False)
+    description = Column(Text, nullable=True)
+    filename = Column(String(255), nullable=False)
+    thumbnail = Column(String(255), nullable=True)
+    category = Column(String(100), nullable=False)
+
+
+def load_offset_orm(session):
+    """改造前的加载方式"""
+    existing_photos_map = {}
+    batch_size = 1000
+    offset = 0
+    while True:
+        batch = session.query(Photo).offset(offset).limit(batch_size).all()
+        if not batch:
+            break
+        for photo in batch:
+            existing_photos_map[f"{photo.category}/{photo.filename}"] = photo
+        offset += batch_size
+        del batch
+    return existing_photos_map
+
+
+def load_streamed_columns(session):
+    """与 app.load_existing_photos 相同的加载方式"""
+    existing_photos = {}
+    query = session.query(Photo.category, Photo.filename, Photo.id)
+    for category, filename, photo_id in query.execution_options(stream_results=True).yield_per(10000):
+        existing_photos.setdefault(category, {})[filename] = photo_id
+    return existing_photos
+
+
+LOADERS = {
+    'offset-orm': load_offset_orm,
+    'streamed-columns': load_streamed_columns,
+}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def seed(path, rows, categories):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE photos (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(255) NOT NULL, "
+        "description TEXT, filename VARCHAR(255) NOT NULL, thumbnail VARCHAR(255), category VARCHAR(100) NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO photos (title, filename, thumbnail, category) VALUES (?, ?, ?, ?)",
+        ((f"IMG_{i:08d}", f"IMG_{i:08d}.jpg", f"IMG_{i:08d}.jpg", f"分类{i % categories:03d}")
+         for i in range(rows))
+    )
+    conn.execute("CREATE UNIQUE INDEX ix_photos_category_filename ON photos (category, filename)")
+    conn.commit()
+    conn.close()
+
+
+def run_worker(loader, path):
+    engine = create_engine(f"sqlite:///{path}")
+    with Session(engine) as session:
+        tracemalloc.start()
+        start = time.perf_counter()
+        mapping = LOADERS[loader](session)
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entries = sum(len(v) for v in mapping.values()) if loader == 'streamed-columns' else len(mapping)
+    print(json.dumps({
+        'loader': loader,
+        'entries': entries,
+        'seconds': elapsed,
+        'retained_mb': retained / (1024 * 1024),
+        'traced_peak_mb': peak / (1024 * 1024),
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--worker', choices=LOADERS, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.db)
+        return
+
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='existing_map_bench_')
+    os.close(fd)
+    os.remove(path)
+    try:
+        print(f"写入 {args.rows} 行 ...")
+        seed(path, args.rows, args.categories)
+
+        print(f"{'加载方式':<20}{'条目':>10}{'耗时s':>10}{'映射MB':>10}{'分配峰值MB':>12}{'峰值RSS MB':>12}")
+        for loader in LOADERS:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', loader, '--db', path],
+                capture_output=True, text=True, check=True
+            )
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            rss = r['peak_rss_mb']
+            print(f"{loader:<20}{r['entries']:>10}{r['seconds']:>10.2f}{r['retained_mb']:>10.1f}"
+                  f"{r['traced_peak_mb']:>12.1f}{(f'{rss:.1f}' if rss else 'n/a'):>12}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""photos 表索引基准测试：在临时 SQLite 库中写入大量照片记录，对比建索引前后的查询耗时
+
+用法：
+    python benchmarks/bench_photo_indexes.py                # 500k 行、50 个分类
+    python benchmarks/bench_photo_indexes.py --rows 100000 --categories 20
+
+测试的查询与 app.py 中的接口一致：分类分页（首页 / 深翻页 / 键集游标）、按分类计数、
+分类列表（DISTINCT 与松散索引扫描）以及扫描时的 (category, filename) 存在性查询。
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+SCHEMA = """
+CREATE TABLE photos (
+    id INTEGER NOT NULL PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    description TEXT,
+    filename VARCHAR(255) NOT NULL,
+    thumbnail VARCHAR(255),
+    category VARCHAR(100) NOT NULL
+)
+"""
+
+INDEXES = [
+    "CREATE UNIQUE INDEX ix_photos_category_filename ON photos (category, filename)",
+    "CREATE INDEX ix_photos_filename ON photos (filename)",
+]
+
+CATEGORY_SKIP_SCAN = """
+WITH RECURSIVE cats(category) AS (
+    SELECT MIN(category) FROM photos
+    UNION ALL
+    SELECT (SELECT MIN(category) FROM photos WHERE category > cats.category)
+    FROM cats WHERE cats.category IS NOT NULL
+)
+SELECT category FROM cats WHERE category IS NOT NULL
+"""
+
+
+def seed(conn, rows, categories):
+    rng = random.Random(42)
+    names = [f"分类{i:03d}" for i in range(categories)]
+
+    def generate():
+        for i in range(rows):
+            filename = f"IMG_{rng.randrange(10 ** 8):08d}_{i}.jpg"
+            yield filename[:-4], filename, filename, names[i % categories]
+
+    conn.executemany(
+        "INSERT INTO photos (title, filename, thumbnail, category) VALUES (?, ?, ?, ?)",
+        generate()
+    )
+    conn.commit()
+    return names
+
+
+def timed(conn, sql, params_list, repeat):
+    """执行 repeat 轮查询，返回单次查询的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    count = 0
+    for _ in range(repeat):
+        for params in params_list:
+            conn.execute(sql, params).fetchall()
+            count += 1
+    return (time.perf_counter() - start) * 1000 / count
+
+
+def run_queries(conn, names, repeat):
+    category = names[len(names) // 2]
+    per_page = 12
+    per_category = conn.execute("SELECT COUNT(*) FROM photos WHERE category = ?", (category,)).fetchone()[0]
+    deep_offset = max(0, per_category - per_page)
+    last = conn.execute(
+        "SELECT filename, id FROM photos WHERE category = ? ORDER BY filename, id LIMIT 1 OFFSET ?",
+        (category, deep_offset)
+    ).fetchone()
+    samples = conn.execute(
+        "SELECT category, filename FROM photos ORDER BY random() LIMIT 200"
+    ).fetchall()
+
+    page_sql = "SELECT * FROM photos WHERE category = ? ORDER BY filename, id LIMIT ? OFFSET ?"
+    return {
+        '分类首页': timed(conn, page_sql, [(category, per_page, 0)], repeat),
+        '分类深翻页(OFFSET)': timed(conn, page_sql, [(category, per_page, deep_offset)], repeat),
+        '分类深翻页(游标)': timed(
+            conn,
+            "SELECT * FROM photos WHERE category = ? AND (filename > ? OR (filename = ? AND id > ?)) "
+            "ORDER BY filename, id LIMIT ?",
+            [(category, last[0], last[0], last[1], per_page)], repeat
+        ),
+        '全部照片首页': timed(conn, "SELECT * FROM photos ORDER BY filename, id LIMIT 12", [()], repeat),
+        '分类计数': timed(conn, "SELECT COUNT(*) FROM photos WHERE category = ?", [(category,)], repeat),
+        '分类列表(DISTINCT)': timed(conn, "SELECT DISTINCT category FROM photos", [()], repeat),
+        '分类列表(松散索引扫描)': timed(conn, CATEGORY_SKIP_SCAN, [()], repeat),
+        '存在性查询': timed(
+            conn, "SELECT id FROM photos WHERE category = ? AND filename = ?", samples, 1
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='photo_index_bench_')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute(SCHEMA)
+        print(f"写入 {args.rows} 行（{args.categories} 个分类）...")
+        start = time.perf_counter()
+        names = seed(conn, args.rows, args.categories)
+        print(f"写入耗时 {time.perf_counter() - start:.1f}s")
+
+        before = run_queries(conn, names, args.repeat)
+
+        start = time.perf_counter()
+        for sql in INDEXES:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"建索引耗时 {time.perf_counter() - start:.1f}s")
+
+        after = run_queries(conn, names, args.repeat)
+        conn.close()
+
+        print(f"\n{'查询':<24}{'无索引 ms':>12}{'有索引 ms':>12}{'加速':>10}")
+        for name, before_ms in before.items():
+            after_ms = after[name]
+            speedup = before_ms / after_ms if after_ms else float('inf')
+            print(f"{name:<24}{before_ms:>12.3f}{after_ms:>12.3f}{speedup:>9.1f}x")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
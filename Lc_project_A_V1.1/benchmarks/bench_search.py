@@ -0,0 +1,157 @@
+"""照片检索基准：在临时 SQLite 库中写入大量中文标题的照片记录，对比索引检索与 LIKE 全表扫描的检索耗时
+
+用法：
+    python benchmarks/bench_search.py                 # 1M 行
+    python benchmarks/bench_search.py --rows 200000
+
+全文索引、二字索引的建表语句和同步触发器直接取自 search.py，查询与 /api/photos?q= 相同：
+先计数（上限 10000），三个字以上的检索词命中数不超过 RANK_LIMIT 时按 bm25 排序取一页（12 条），
+否则按 rowid 取一页；不足三个字的检索词查 photo_grams（单字 / 二字索引），按 rowid 取一页。
+报告每种检索词的 p50 / p99 耗时（毫秒）。
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import (CREATE_FTS_SQL, FTS_TRIGGERS, CREATE_GRAM_SQL, GRAM_TRIGGERS,  # noqa: E402
+                    GRAM_MAX_POSITION, TRIGRAM_MIN_LENGTH, RANK_LIMIT)
+
+COUNT_LIMIT = 10000
+PER_PAGE = 12
+
+WORDS = ['春节', '旅行', '北京', '上海', '海边', '日落', '家人', '生日', '毕业典礼', '婚礼', '樱花', '雪山',
+         '西湖', '长城', '故宫', '夜景', '宝宝', '小猫', '聚会', '年会', '公园', '花园', '骑行', '徒步']
+
+
+def seed(conn, rows):
+    rng = random.Random(42)
+
+    def generate():
+        for i in range(rows):
+            title = f"{rng.choice(WORDS)}{rng.choice(WORDS)}_{2000 + i % 25}_{i:07d}"
+            yield title, f"{title}.jpg", f"分类{i % 50:02d}"
+
+    conn.execute(
+        "CREATE TABLE photos (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(255) NOT NULL, "
+        "description TEXT, filename VARCHAR(255) NOT NULL, thumbnail VARCHAR(255), category VARCHAR(100) NOT NULL)"
+    )
+    conn.execute(CREATE_FTS_SQL.format(tokenizer='trigram'))
+    for sql in CREATE_GRAM_SQL:
+        conn.execute(sql)
+    conn.execute("WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?) "
+                 "INSERT INTO search_positions (n) SELECT n FROM seq", (GRAM_MAX_POSITION,))
+    for trigger in FTS_TRIGGERS + GRAM_TRIGGERS:
+        conn.execute(trigger)
+    conn.executemany("INSERT INTO photos (title, filename, category) VALUES (?, ?, ?)", generate())
+    conn.commit()
+
+
+def like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def search_fts(conn, term):
+    match = '"' + term.replace('"', '""') + '"'
+    total = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT p.id FROM photos p JOIN photos_fts ON photos_fts.rowid = p.id "
+        "WHERE photos_fts MATCH ? LIMIT ?)", (match, COUNT_LIMIT)
+    ).fetchone()[0]
+    order = "bm25(photos_fts, 10.0, 1.0), p.id" if total <= RANK_LIMIT else "photos_fts.rowid"
+    conn.execute(
+        "SELECT p.* FROM photos p JOIN photos_fts ON photos_fts.rowid = p.id WHERE photos_fts MATCH ? "
+        f"ORDER BY {order} LIMIT ?", (match, PER_PAGE)
+    ).fetchall()
+    return total
+
+
+def search_grams(conn, term):
+    match = '"' + term.lower().encode('utf-8').hex().upper() + '"'
+    source = "photos p JOIN photo_grams ON photo_grams.rowid = p.id WHERE photo_grams MATCH ?"
+    total = conn.execute(
+        f"SELECT COUNT(*) FROM (SELECT p.id FROM {source} LIMIT ?)", (match, COUNT_LIMIT)
+    ).fetchone()[0]
+    conn.execute(f"SELECT p.* FROM {source} ORDER BY photo_grams.rowid LIMIT ?", (match, PER_PAGE)).fetchall()
+    return total
+
+
+def index_size_mb(conn, name):
+    """某张表（含其索引）占用的空间，SQLite 未编译 dbstat 时返回 None"""
+    try:
+        size = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    return (size or 0) / (1024 * 1024)
+
+
+def search_like(conn, term):
+    pattern = like_pattern(term)
+    where = "(title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')"
+    conn.execute(
+        f"SELECT * FROM photos WHERE {where} ORDER BY filename, id LIMIT ?", (pattern, pattern, PER_PAGE)
+    ).fetchall()
+    return conn.execute(
+        f"SELECT COUNT(*) FROM (SELECT id FROM photos WHERE {where} LIMIT ?)", (pattern, pattern, COUNT_LIMIT)
+    ).fetchone()[0]
+
+
+def timed(func, conn, term, repeat):
+    samples = []
+    hits = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = func(conn, term)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return hits, samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='search_bench_')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        print(f"写入 {args.rows} 行并建立全文索引 ...")
+        start = time.perf_counter()
+        seed(conn, args.rows)
+        print(f"写入耗时 {time.perf_counter() - start:.1f}s，数据库 {os.path.getsize(path) / (1024 * 1024):.0f}MB")
+        for table in ('photos', 'photos_fts_data', 'photo_grams_data'):
+            size = index_size_mb(conn, table)
+            if size is not None:
+                print(f"  {table}: {size:.0f}MB")
+
+        terms = [
+            ('稀有精确', f"_{args.rows // 2:07d}"),
+            ('中文词组', '毕业典礼'),
+            ('中文三字', '樱花雪'),
+            ('年份', '_2013_'),
+            ('两字', '西湖'),
+            ('两字(跨词)', '湖长'),
+            ('两字(无命中)', '小狗'),
+            ('单字', '猫'),
+        ]
+        print(f"\n{'检索词':<14}{'命中':>8}{'索引 p50':>10}{'索引 p99':>10}{'LIKE p50':>10}{'LIKE p99':>10}")
+        for name, term in terms:
+            search = search_fts if len(term) >= TRIGRAM_MIN_LENGTH else search_grams
+            hits, p50, p99 = timed(search, conn, term, args.repeat)
+            like_hits, like_p50, like_p99 = timed(search_like, conn, term, max(1, args.repeat // 4))
+            if like_hits != hits:
+                print(f"{name}: 索引命中 {hits} 与 LIKE 命中 {like_hits} 不一致", file=sys.stderr)
+            print(f"{name:<14}{hits:>8}{p50:>10.2f}{p99:>10.2f}{like_p50:>10.2f}{like_p99:>10.2f}")
+        conn.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
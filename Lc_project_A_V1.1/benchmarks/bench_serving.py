@@ -0,0 +1,228 @@
+"""图片服务负载基准：在临时照片目录上启动服务，用本地并发客户端请求缩略图和原图
+
+用法：
+    python benchmarks/bench_serving.py                          # waitress（已安装时），否则开发服务器
+    python benchmarks/bench_serving.py --server werkzeug --concurrency 32 --duration 20
+    python benchmarks/bench_serving.py --count 100 --width 6000 --height 4000
+
+服务在独立子进程中运行（生成合成照片后由启动扫描建立索引和缩略图），客户端每个线程使用一条
+keep-alive 连接，分别报告缩略图、原图、原图分段（Range 前 64KB）的请求/秒、吞吐和 p50 / p99 延迟。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RANGE_BYTES = 64 * 1024
+
+
+def serve(root, server, port):
+    """子进程入口：以临时目录为照片库启动服务"""
+    from config import Config
+    from app import create_app, start_background_tasks
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(root, 'bench.db')
+        PHOTO_FOLDER = os.path.join(root, 'photo')
+        THUMBNAIL_FOLDER = os.path.join(root, 'thumbnails')
+        DERIVATIVE_FOLDER = os.path.join(root, 'thumbnails', '.derivatives')
+        THUMBNAIL_SHARED_FOLDER = os.path.join(root, 'thumbnails', '.shared')
+        MIGRATION_LOCK_FILE = os.path.join(root, 'migration.lock')
+        BACKGROUND_LOCK_FILE = os.path.join(root, 'background.lock')
+        WATCH_PHOTO_FOLDER = False
+
+    app = create_app(BenchConfig)
+    start_background_tasks(app)
+    if server == 'waitress':
+        from waitress import serve as waitress_serve
+        waitress_serve(app, host='127.0.0.1', port=port, threads=16, _quiet=True)
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def seed(photo_root, count, width, height, categories):
+    from bench_thumbnail import make_corpus
+
+    for i in range(categories):
+        folder = os.path.join(photo_root, f"分类{i}")
+        os.makedirs(folder)
+        make_corpus(folder, max(1, count // categories), width, height)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def wait_until_ready(port, proc, timeout):
+    """等待服务启动且启动扫描完成"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('服务进程已退出')
+        try:
+            health = get_json(port, '/api/health')
+            job = health.get('scan_job')
+            if health.get('scan_finished') and job and job['state'] != 'running':
+                return health
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('等待服务就绪超时')
+
+
+def list_photos(port):
+    photos = []
+    cursor = None
+    while True:
+        path = '/api/photos?per_page=100' + (f"&after={quote(cursor)}" if cursor else '')
+        data = get_json(port, path)
+        photos.extend(data['photos'])
+        cursor = data.get('next_cursor')
+        if not cursor:
+            return photos
+
+
+def build_requests(photos):
+    thumbnails = []
+    originals = []
+    for photo in photos:
+        category = quote(photo['category'])
+        thumb, _, version = photo['thumbnail'].partition('?')
+        thumbnails.append((f"/thumbnails/{category}/{quote(thumb)}" + (f"?{version}" if version else ''), {}))
+        originals.append((f"/photo/{category}/{quote(photo['filename'])}", {}))
+    ranged = [(path, {'Range': f"bytes=0-{RANGE_BYTES - 1}"}) for path, _ in originals]
+    return {'缩略图': thumbnails, '原图': originals, '原图Range': ranged}
+
+
+def run_load(port, requests, concurrency, duration):
+    """concurrency 个线程在 duration 秒内循环请求，返回 (延迟列表ms, 字节数, 错误数, 实际秒数)"""
+    latencies = []
+    totals = {'bytes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        received = errors = 0
+        while time.monotonic() < stop_at:
+            path, headers = rng.choice(requests)
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=dict(headers, **{'Accept': 'image/avif,image/webp,*/*'}))
+                response = conn.getresponse()
+                body = response.read()
+                if response.status not in (200, 206):
+                    errors += 1
+                received += len(body)
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            totals['bytes'] += received
+            totals['errors'] += errors
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, totals['bytes'], totals['errors'], time.monotonic() - start
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('waitress', 'werkzeug'))
+    parser.add_argument('--count', type=int, default=40, help='合成照片数量')
+    parser.add_argument('--categories', type=int, default=4)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='每类请求的压测秒数')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    server = args.server
+    if not server:
+        try:
+            import waitress  # noqa: F401
+            server = 'waitress'
+        except ImportError:
+            server = 'werkzeug'
+
+    if args.serve:
+        serve(args.serve, server, args.port)
+        return
+
+    root = tempfile.mkdtemp(prefix='serving_bench_')
+    proc = None
+    try:
+        print(f"生成 {args.count} 张 {args.width}x{args.height} 合成照片 ...")
+        seed(os.path.join(root, 'photo'), args.count, args.width, args.height, args.categories)
+
+        port = free_port()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', root, '--port', str(port), '--server', server],
+            stdout=subprocess.DEVNULL
+        )
+        wait_until_ready(port, proc, timeout=600)
+        photos = list_photos(port)
+        print(f"服务器 {server}，{len(photos)} 张照片，并发 {args.concurrency}，每类 {args.duration:.0f} 秒")
+
+        print(f"\n{'请求':<12}{'次数':>8}{'错误':>6}{'请求/秒':>10}{'MB/秒':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, requests in build_requests(photos).items():
+            latencies, received, errors, elapsed = run_load(port, requests, args.concurrency, args.duration)
+            latencies = latencies or [0.0]
+            print(f"{name:<12}{len(latencies):>8}{errors:>6}{len(latencies) / elapsed:>10.1f}"
+                  f"{received / elapsed / (1024 * 1024):>10.1f}"
+                  f"{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""相似照片检索基准：在临时 SQLite 库中写入大量感知哈希，对比分段索引查找与逐一比较的耗时
+
+用法：
+    python benchmarks/bench_similar.py                  # 500k 行
+    python benchmarks/bench_similar.py --rows 100000
+
+照片按“连拍组”生成：每组一个随机哈希，组内其余照片随机翻转 1~6 位。
+分段字段、索引和候选条件与 /api/photos/<id>/similar 相同（取自 similarity.py），
+报告各距离阈值下的候选数、命中数和 p50 / p99 耗时（毫秒）。
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import (BAND_COLUMNS, HASH_BITS, band_neighbors, split_bands, phash_columns,  # noqa: E402
+                        hamming_distance, DEFAULT_MAX_DISTANCE, MAX_DISTANCE)
+
+BURST_SIZE = 6
+
+
+def seed(conn, rows):
+    rng = random.Random(42)
+
+    def generate():
+        base = 0
+        for i in range(rows):
+            if i % BURST_SIZE == 0:
+                base = rng.getrandbits(HASH_BITS)
+                value = base
+            else:
+                value = base
+                for bit in rng.sample(range(HASH_BITS), rng.randint(1, 6)):
+                    value ^= 1 << bit
+            columns = phash_columns(value)
+            yield (columns['phash'],) + tuple(columns[band] for band in BAND_COLUMNS)
+
+    conn.execute(
+        "CREATE TABLE photos (id INTEGER NOT NULL PRIMARY KEY, phash BIGINT, "
+        + ', '.join(f"{band} INTEGER" for band in BAND_COLUMNS) + ")"
+    )
+    conn.executemany(
+        f"INSERT INTO photos (phash, {', '.join(BAND_COLUMNS)}) VALUES (?{', ?' * len(BAND_COLUMNS)})",
+        generate()
+    )
+    for band in BAND_COLUMNS:
+        conn.execute(f"CREATE INDEX ix_photos_{band} ON photos ({band})")
+    conn.commit()
+
+
+def search_bands(conn, photo_id, phash, max_distance):
+    radius = max_distance // len(BAND_COLUMNS)
+    conditions = []
+    params = []
+    for band, value in zip(BAND_COLUMNS, split_bands(phash)):
+        values = band_neighbors(value, radius)
+        conditions.append(f"{band} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    rows = conn.execute(
+        f"SELECT id, phash FROM photos WHERE ({' OR '.join(conditions)}) AND id != ?", params + [photo_id]
+    ).fetchall()
+    hits = sum(1 for _, other in rows if hamming_distance(phash, other) <= max_distance)
+    return len(rows), hits
+
+
+def search_scan(conn, photo_id, phash, max_distance):
+    rows = conn.execute("SELECT id, phash FROM photos WHERE id != ?", (photo_id,)).fetchall()
+    hits = sum(1 for _, other in rows if hamming_distance(phash, other) <= max_distance)
+    return len(rows), hits
+
+
+def timed(func, conn, targets, max_distance):
+    samples = []
+    candidates = hits = 0
+    for photo_id, phash in targets:
+        start = time.perf_counter()
+        found, matched = func(conn, photo_id, phash, max_distance)
+        samples.append((time.perf_counter() - start) * 1000)
+        candidates += found
+        hits += matched
+    samples.sort()
+    return (candidates / len(targets), hits / len(targets),
+            samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='similar_bench_')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        print(f"写入 {args.rows} 行并建立分段索引 ...")
+        start = time.perf_counter()
+        seed(conn, args.rows)
+        print(f"写入耗时 {time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(7)
+        targets = [conn.execute("SELECT id, phash FROM photos WHERE id = ?", (rng.randint(1, args.rows),)).fetchone()
+                   for _ in range(args.queries)]
+
+        print(f"\n{'方式':<10}{'距离':>6}{'候选':>10}{'命中':>8}{'p50 ms':>10}{'p99 ms':>10}")
+        for max_distance in sorted({4, 8, DEFAULT_MAX_DISTANCE, MAX_DISTANCE}):
+            found, hits, p50, p99 = timed(search_bands, conn, targets, max_distance)
+            print(f"{'分段索引':<10}{max_distance:>6}{found:>10.0f}{hits:>8.1f}{p50:>10.2f}{p99:>10.2f}")
+        found, hits, p50, p99 = timed(search_scan, conn, targets[:5], DEFAULT_MAX_DISTANCE)
+        print(f"{'逐一比较':<10}{DEFAULT_MAX_DISTANCE:>6}{found:>10.0f}{hits:>8.1f}{p50:>10.2f}{p99:>10.2f}")
+        conn.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
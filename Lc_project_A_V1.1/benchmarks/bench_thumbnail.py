@@ -0,0 +1,170 @@
+"""缩略图引擎基准测试：对比旧版（verify + 重新打开 + 全尺寸解码）与单次解码引擎
+
+用法：
+    python benchmarks/bench_thumbnail.py                 # 生成 8 张 24MP 合成 JPEG 进行测试
+    python benchmarks/bench_thumbnail.py --corpus DIR    # 使用指定目录下的图片
+
+每种实现在独立子进程中运行，分别报告单张耗时（平均 / p50 / p95）和进程峰值 RSS。
+合成图片也在单独的子进程中生成，测试进程不继承生成图片时的内存峰值。
+
+旧版的 Image.thumbnail() 本身就会以 reducing_gap=2.0 调用 draft()，JPEG 同样按 DCT 缩放解码，
+所以两者的耗时和峰值内存基本相同；单次解码引擎省下的只是 verify() 和重新打开文件。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from config import Config  # noqa: E402
+from thumbnailer import render_thumbnail  # noqa: E402
+
+IMAGE_EXTENSIONS = tuple(f".{ext}" for ext in Config.ALLOWED_EXTENSIONS)
+
+
+def legacy_render_thumbnail(src_path, dest_path, size):
+    """改造前 create_thumbnail 的处理流程（去掉 Flask 日志部分）"""
+    try:
+        if not os.path.exists(src_path) or not os.access(src_path, os.R_OK):
+            return False, f"无法读取源文件: {src_path}"
+
+        try:
+            with Image.open(src_path) as img:
+                img.verify()
+        except (IOError, SyntaxError) as e:
+            return False, f"损坏的图片文件: {src_path} - {str(e)}"
+
+        with Image.open(src_path) as img:
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.thumbnail(size)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            img.save(dest_path, optimize=True, quality=85)
+
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+ENGINES = {
+    'legacy': legacy_render_thumbnail,
+    'single-decode': render_thumbnail,
+}
+
+
+def peak_rss_mb():
+    """当前进程的峰值 RSS（MB），不支持的平台返回 None
+
+    Linux 读取 /proc/self/status 中的 VmHWM：ru_maxrss 在 exec 后保留父进程的峰值，
+    会把启动测试的进程占用的内存也算进来。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_corpus(folder, count, width, height):
+    """生成带噪声的合成照片，压缩率接近真实照片"""
+    base = Image.effect_noise((width // 8, height // 8), 64).convert('RGB')
+    base = base.resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    for i in range(count):
+        img = Image.blend(base, gradient, (i + 1) / (count + 1))
+        img.save(os.path.join(folder, f"bench_{i:03d}.jpg"), quality=92)
+
+
+def run_worker(engine, corpus, out_dir):
+    """子进程入口：用指定引擎处理整个目录，输出 JSON 结果"""
+    render = ENGINES[engine]
+    size = Config.THUMBNAIL_MAX_SIZE
+    files = sorted(f for f in os.listdir(corpus) if f.lower().endswith(IMAGE_EXTENSIONS))
+    latencies = []
+    failures = 0
+    for filename in files:
+        start = time.perf_counter()
+        ok, _ = render(os.path.join(corpus, filename), os.path.join(out_dir, filename), size)
+        latencies.append((time.perf_counter() - start) * 1000)
+        failures += 0 if ok else 1
+    print(json.dumps({
+        'engine': engine,
+        'latencies_ms': latencies,
+        'failures': failures,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='图片目录（默认生成合成图片）')
+    parser.add_argument('--count', type=int, default=8, help='合成图片数量')
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--worker', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('--make-corpus', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make_corpus:
+        make_corpus(args.out, args.count, args.width, args.height)
+        return
+    if args.worker:
+        run_worker(args.worker, args.corpus, args.out)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='thumb_bench_')
+    try:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(workdir, 'corpus')
+            os.makedirs(corpus)
+            print(f"生成 {args.count} 张 {args.width}x{args.height} 合成 JPEG ...")
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--make-corpus', '--out', corpus,
+                 '--count', str(args.count), '--width', str(args.width), '--height', str(args.height)],
+                check=True
+            )
+
+        print(f"{'引擎':<16}{'张数':>6}{'失败':>6}{'平均ms':>10}{'p50ms':>10}{'p95ms':>10}{'峰值RSS MB':>12}")
+        for engine in ENGINES:
+            out_dir = os.path.join(workdir, engine)
+            os.makedirs(out_dir)
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', engine,
+                 '--corpus', corpus, '--out', out_dir],
+                capture_output=True, text=True, check=True
+            )
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            latencies = result['latencies_ms'] or [0.0]
+            rss = result['peak_rss_mb']
+            print(f"{engine:<16}{len(result['latencies_ms']):>6}{result['failures']:>6}"
+                  f"{sum(latencies) / len(latencies):>10.1f}{percentile(latencies, 50):>10.1f}"
+                  f"{percentile(latencies, 95):>10.1f}{(f'{rss:.1f}' if rss else 'n/a'):>12}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""缩略图输出格式基准：对比旧版（按原图格式保存）与 AVIF / WebP / JPEG 的总字节数和编码耗时
+
+用法：
+    python benchmarks/bench_thumbnail_formats.py                 # 生成 8 张 24MP 合成 JPEG 进行测试
+    python benchmarks/bench_thumbnail_formats.py --corpus DIR    # 使用指定目录下的图片
+
+报告中包含 thumbnailer.THUMBNAIL_FORMATS 的全部格式（不限于 Config.THUMBNAIL_FORMATS 启用的格式），
+另外给出启用格式合计（扫描时每张照片实际写入的字节数和编码耗时）。
+
+当前 Pillow 不支持编码的格式会被跳过（见 thumbnailer.supported_formats）。
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from thumbnailer import render_thumbnail, supported_formats, variant_path, THUMBNAIL_FORMATS  # noqa: E402
+from bench_thumbnail import IMAGE_EXTENSIONS, make_corpus  # noqa: E402
+
+
+def run(sources, out_dir, size, formats):
+    """生成整组缩略图，返回 (总字节数, 总耗时秒, 失败数)"""
+    total_bytes = 0
+    failures = 0
+    start = time.perf_counter()
+    for src in sources:
+        dest = os.path.join(out_dir, os.path.basename(src))
+        ok, error = render_thumbnail(src, dest, size, formats)
+        if not ok:
+            failures += 1
+            print(error, file=sys.stderr)
+            continue
+        paths = [variant_path(dest, fmt) for fmt in formats] if formats else [dest]
+        total_bytes += sum(os.path.getsize(path) for path in paths)
+    return total_bytes, time.perf_counter() - start, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='图片目录（默认生成合成图片）')
+    parser.add_argument('--count', type=int, default=8)
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='thumb_format_bench_')
+    try:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(work_dir, 'corpus')
+            os.makedirs(corpus)
+            print(f"生成 {args.count} 张 {args.width}x{args.height} 合成图片 ...")
+            make_corpus(corpus, args.count, args.width, args.height)
+        sources = sorted(
+            os.path.join(corpus, name) for name in os.listdir(corpus)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+        # 未启用的格式（如 AVIF）也参与对比
+        cases = [('legacy', None)] + [(fmt, [fmt]) for fmt in supported_formats(THUMBNAIL_FORMATS)]
+        enabled = supported_formats(Config.THUMBNAIL_FORMATS)
+        cases.append(('+'.join(enabled), enabled))
+        results = {}
+        for name, formats in cases:
+            out_dir = os.path.join(work_dir, name)
+            results[name] = run(sources, out_dir, Config.THUMBNAIL_MAX_SIZE, formats)
+
+        baseline = results['legacy'][0] or 1
+        print(f"\n{len(sources)} 张图片，缩略图尺寸 {Config.THUMBNAIL_MAX_SIZE}")
+        print(f"{'格式':<10}{'总字节':>14}{'相对旧版':>10}{'单张KB':>10}{'单张ms':>10}{'失败':>6}")
+        for name, (total_bytes, seconds, failures) in results.items():
+            done = max(1, len(sources) - failures)
+            print(f"{name:<10}{total_bytes:>14}{total_bytes / baseline:>9.0%} "
+                  f"{total_bytes / done / 1024:>9.1f}{seconds * 1000 / done:>10.1f}{failures:>6}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""按需生成的多尺寸衍生图（查看大图、不同屏幕密度使用）和每页缩略图雪碧图
+
+衍生图按 <缓存目录>/<宽度>/<分类>/<文件名>.<格式扩展名> 存放，雪碧图按 <缓存目录>/sprites/<内容摘要>.jpg 存放，
+两者共用一个总大小上限，超过时按最近使用时间淘汰。同一张图的并发请求只生成一次，其余请求等待结果。
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from thumbnailer import render_thumbnail, render_sprite, variant_path
+
+logger = logging.getLogger(__name__)
+
+
+class DerivativeCache:
+    """磁盘 LRU 缓存 + 请求合并
+
+    缓存索引在首次使用时扫描缓存目录建立（按访问时间排序），命中时只更新访问时间
+    （修改时间参与 ETag 计算，不能改动），重启后仍能保持大致的使用顺序。
+    多进程部署时各进程分别统计，总大小上限为近似值。
+    """
+
+    def __init__(self, root, max_bytes, wait_timeout=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._inflight = {}  # 缓存路径 -> threading.Event
+        self._entries = None  # 缓存路径 -> 文件大小（按使用时间从旧到新）
+        self._total_bytes = 0
+
+    def path_for(self, width, category, filename, fmt):
+        return variant_path(os.path.join(self.root, str(width), category, filename), fmt)
+
+    def get(self, width, src_path, category, filename, fmt):
+        """返回宽度为 width、格式为 fmt 的衍生图路径（按需生成），失败返回 None"""
+        dest_path = self.path_for(width, category, filename, fmt)
+        try:
+            src_mtime = os.stat(src_path).st_mtime_ns
+        except OSError:
+            return None
+
+        return self._get_or_render(
+            dest_path, fmt,
+            lambda: self._is_fresh(dest_path, src_mtime),
+            lambda tmp_base: render_thumbnail(src_path, tmp_base, (width, width), [fmt])
+        )
+
+    def sprite_path(self, digest):
+        return variant_path(os.path.join(self.root, 'sprites', digest), 'jpeg')
+
+    def get_sprite(self, digest, tile_paths, tile_size, columns):
+        """返回由 tile_paths 拼成的雪碧图路径（按需生成），失败返回 None
+
+        digest 由调用方按照片 id 和缩略图版本号计算，内容变化后路径随之变化，已存在即为最新。
+        """
+        dest_path = self.sprite_path(digest)
+        return self._get_or_render(
+            dest_path, 'jpeg',
+            lambda: os.path.exists(dest_path),
+            lambda tmp_base: render_sprite(tile_paths, variant_path(tmp_base, 'jpeg'), tile_size, columns)
+        )
+
+    def _get_or_render(self, dest_path, fmt, is_fresh, render):
+        """缓存命中时直接返回，否则合并并发请求，由第一个请求调用 render(临时文件基础路径) 生成"""
+        if is_fresh():
+            self._touch(dest_path)
+            return dest_path
+
+        with self._lock:
+            event = self._inflight.get(dest_path)
+            leader = event is None
+            if leader:
+                event = self._inflight[dest_path] = threading.Event()
+
+        if not leader:
+            # 其他请求正在生成同一张图，等待其完成
+            event.wait(self.wait_timeout)
+            return dest_path if is_fresh() else None
+
+        try:
+            # 再检查一次：等待锁期间可能已有请求生成完毕
+            if is_fresh():
+                self._touch(dest_path)
+                return dest_path
+            return self._render(dest_path, fmt, render)
+        finally:
+            with self._lock:
+                self._inflight.pop(dest_path, None)
+            event.set()
+
+    def _is_fresh(self, dest_path, src_mtime):
+        try:
+            return os.stat(dest_path).st_mtime_ns >= src_mtime
+        except OSError:
+            return False
+
+    def _render(self, dest_path, fmt, render):
+        # 先写入临时文件再原子替换，避免并发读到半截文件
+        base, _ = os.path.splitext(dest_path)
+        tmp_base = f"{base}.{uuid.uuid4().hex}.part"
+        tmp_path = variant_path(tmp_base, fmt)
+        ok, error = render(tmp_base)
+        if not ok:
+            logger.error(error)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.replace(tmp_path, dest_path)
+            size = os.path.getsize(dest_path)
+        except OSError as e:
+            logger.error(f"保存衍生图失败 {dest_path}: {e}")
+            return None
+        self._add(dest_path, size)
+        return dest_path
+
+    def _load_entries(self):
+        """扫描缓存目录建立 LRU 索引（调用方持有锁）"""
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if '.part.' in name:
+                    # 生成中的临时文件不计入缓存；上次异常退出遗留的（超过1小时）顺便清理
+                    if time.time() - st.st_mtime > 3600:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                files.append((st.st_atime, path, st.st_size))
+        files.sort()
+        self._entries = OrderedDict((path, size) for _, path, size in files)
+        self._total_bytes = sum(self._entries.values())
+
+    def _touch(self, path):
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+
+    def _add(self, path, size):
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            self._total_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._total_bytes += size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        if evicted:
+            logger.info(f"衍生图缓存超出上限，已淘汰 {len(evicted)} 个文件")
@@ -0,0 +1,198 @@
+"""轻量级数据库结构版本管理
+
+结构版本号保存在 schema_info 表中。启动时先 create_all() 创建缺失的表，
+再按顺序执行尚未应用的迁移步骤。修改已有表（新增字段、索引）时，
+在 MIGRATIONS 末尾追加一个步骤，不要修改已发布的步骤。
+"""
+import os
+from flask import current_app
+from sqlalchemy import inspect, text
+from models import db, SchemaInfo, refresh_category_stats
+from thumbnailer import thumbnail_version, variant_path, shared_thumbnail_base
+from search import create_search_index, create_gram_index
+from similarity import BAND_COLUMNS
+
+SCHEMA_VERSION_KEY = 'schema_version'
+
+
+def _initial_schema(conn):
+    """photos、photo_manifest、schema_info 均由 create_all 创建，无需额外操作"""
+
+
+def _photo_indexes(conn):
+    """photos 表增加 (category, filename) 唯一索引和 filename 索引，建索引前先清理重复记录"""
+    conn.execute(text(
+        "DELETE FROM photos WHERE id NOT IN "
+        "(SELECT MIN(id) FROM photos GROUP BY category, filename)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_photos_category_filename ON photos (category, filename)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_photos_filename ON photos (filename)"))
+
+
+def _add_column(conn, table, column, ddl):
+    """表中没有该字段时追加（create_all 不会修改已有表）"""
+    if column not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _thumb_version(conn):
+    """photos 表增加 thumb_version 字段，并按清单中的原图大小和修改时间回填"""
+    _add_column(conn, 'photos', 'thumb_version', 'VARCHAR(16)')
+    rows = conn.execute(text(
+        "SELECT p.id, m.size, m.mtime_ns FROM photos p "
+        "JOIN photo_manifest m ON m.category = p.category AND m.filename = p.filename"
+    )).fetchall()
+    updates = [{'id': photo_id, 'v': thumbnail_version(size, mtime_ns)} for photo_id, size, mtime_ns in rows]
+    if updates:
+        conn.execute(text("UPDATE photos SET thumb_version = :v WHERE id = :id"), updates)
+
+
+def _scan_jobs(conn):
+    """scan_jobs 表由 create_all 创建；扫描状态改由扫描任务记录，删除 schema_info 中的旧键"""
+    conn.execute(text("DELETE FROM schema_info WHERE key IN ('scan_state', 'scan_progress')"))
+
+
+def _category_stats(conn):
+    """category_stats 表由 create_all 创建，按现有照片和清单回填"""
+    refresh_category_stats(conn)
+
+
+def _search_index(conn):
+    """创建 photos_fts 全文索引和同步触发器，按现有照片建立索引"""
+    create_search_index(conn)
+
+
+def _photo_metadata(conn):
+    """photos 表增加 EXIF 字段和拍摄时间索引；清空扫描清单，下次扫描重新读取所有照片的 EXIF
+
+    缩略图仍是最新的照片只读取文件头，不会重新生成缩略图。
+    """
+    _add_column(conn, 'photos', 'taken_at', 'DATETIME')
+    _add_column(conn, 'photos', 'width', 'INTEGER')
+    _add_column(conn, 'photos', 'height', 'INTEGER')
+    _add_column(conn, 'photos', 'orientation', 'SMALLINT')
+    _add_column(conn, 'photos', 'camera', 'VARCHAR(100)')
+    _add_column(conn, 'photos', 'latitude', 'FLOAT')
+    _add_column(conn, 'photos', 'longitude', 'FLOAT')
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_photos_taken_at ON photos (taken_at, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_photos_category_taken_at ON photos (category, taken_at, id)"
+    ))
+    conn.execute(text("DELETE FROM photo_manifest"))
+    # 原图大小统计来自清单，随下次扫描重新累计
+    refresh_category_stats(conn)
+
+
+def _content_hash(conn):
+    """photos 表增加内容摘要字段和索引；清空扫描清单，下次扫描为所有照片计算摘要并合并重复缩略图"""
+    _add_column(conn, 'photos', 'content_hash', 'VARCHAR(32)')
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_photos_content_hash ON photos (content_hash)"))
+    conn.execute(text("DELETE FROM photo_manifest"))
+    refresh_category_stats(conn)
+
+
+def _perceptual_hash(conn):
+    """photos 表增加感知哈希及其分段字段和索引；清空扫描清单，下次扫描由现有缩略图计算感知哈希"""
+    _add_column(conn, 'photos', 'phash', 'BIGINT')
+    for band in BAND_COLUMNS:
+        _add_column(conn, 'photos', band, 'INTEGER')
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_photos_{band} ON photos ({band})"))
+    conn.execute(text("DELETE FROM photo_manifest"))
+    refresh_category_stats(conn)
+
+
+def _placeholder(conn):
+    """photos 表增加占位图字段；清空扫描清单，下次扫描由现有缩略图生成占位图"""
+    _add_column(conn, 'photos', 'placeholder', 'TEXT')
+    conn.execute(text("DELETE FROM photo_manifest"))
+    refresh_category_stats(conn)
+
+
+def _gram_index(conn):
+    """创建 photo_grams 单字 / 二字索引和同步触发器（不足三个字的检索词），按现有照片建立索引"""
+    create_gram_index(conn)
+
+
+def _rotated_thumbnails(conn):
+    """缩略图改为按 EXIF 方向旋转：删除带方向信息的照片已生成的（未旋转）缩略图、共享缩略图和衍生图，
+    并清除它们的清单记录，下次扫描重新生成缩略图并更新版本号（URL 随之变化）
+    """
+    config = current_app.config
+    formats = config['THUMBNAIL_OUTPUT_FORMATS']
+    rows = conn.execute(text(
+        "SELECT category, filename, thumbnail, content_hash FROM photos WHERE orientation > 1"
+    )).fetchall()
+    for category, filename, thumbnail, digest in rows:
+        bases = [os.path.join(config['THUMBNAIL_FOLDER'], category, thumbnail or filename)]
+        if digest:
+            bases.append(shared_thumbnail_base(config['THUMBNAIL_SHARED_FOLDER'], digest))
+        bases += [os.path.join(config['DERIVATIVE_FOLDER'], str(width), category, filename)
+                  for width in config['DERIVATIVE_WIDTHS']]
+        for base in bases:
+            for fmt in formats:
+                try:
+                    os.remove(variant_path(base, fmt))
+                except FileNotFoundError:
+                    pass
+    conn.execute(text(
+        "DELETE FROM photo_manifest WHERE EXISTS (SELECT 1 FROM photos p WHERE p.orientation > 1 "
+        "AND p.category = photo_manifest.category AND p.filename = photo_manifest.filename)"
+    ))
+    refresh_category_stats(conn)
+
+
+def _manifest_failed(conn):
+    """photo_manifest 表增加 failed 字段：无法解码的文件也登记到清单，文件不变时不再重复处理"""
+    _add_column(conn, 'photo_manifest', 'failed', 'BOOLEAN NOT NULL DEFAULT 0')
+
+
+# (版本号, 说明, 迁移函数)；迁移函数在独立事务中接收一个 Connection
+MIGRATIONS = [
+    (1, '初始结构', _initial_schema),
+    (2, 'photos 表索引与 (category, filename) 唯一约束', _photo_indexes),
+    (3, '缩略图版本号', _thumb_version),
+    (4, '扫描任务表', _scan_jobs),
+    (5, '分类统计表', _category_stats),
+    (6, '标题/描述全文索引', _search_index),
+    (7, 'EXIF 信息与拍摄时间索引', _photo_metadata),
+    (8, '原图内容摘要（重复照片）', _content_hash),
+    (9, '感知哈希（相似照片）', _perceptual_hash),
+    (10, '缩略图占位图', _placeholder),
+    (11, '标题/描述单字、二字检索索引', _gram_index),
+    (12, '缩略图按 EXIF 方向旋转', _rotated_thumbnails),
+    (13, '扫描清单记录处理失败的文件', _manifest_failed),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def upgrade_database(app):
+    """创建缺失的表并执行未应用的迁移，返回当前结构版本"""
+    logger = app.logger
+    existing_tables = set(inspect(db.engine).get_table_names())
+    db.create_all()
+
+    current = SchemaInfo.get_value(SCHEMA_VERSION_KEY)
+    if current is None:
+        # 全新数据库已由 create_all 按最新模型建表；没有版本号的旧数据库从头迁移
+        current = 0 if 'photos' in existing_tables else LATEST_VERSION
+    current = int(current)
+
+    if current > LATEST_VERSION:
+        logger.warning(f"数据库结构版本 {current} 高于程序支持的版本 {LATEST_VERSION}，跳过迁移")
+        return current
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"执行数据库迁移 v{version}: {description}")
+        with db.engine.begin() as conn:
+            migrate(conn)
+        current = version
+        SchemaInfo.set_value(SCHEMA_VERSION_KEY, current)
+        db.session.commit()
+
+    SchemaInfo.set_value(SCHEMA_VERSION_KEY, current)
+    db.session.commit()
+    return current
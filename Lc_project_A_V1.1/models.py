@@ -1,12 +1,47 @@
 import os
+import time
 import logging
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, select, literal, text, bindparam
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
+from thumbnailer import variant_path
+from search import create_search_index
 
 logger = logging.getLogger(__name__)
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """SQLite 使用 WAL 日志：扫描分批提交时，读请求始终看到最近一次提交的一致快照，互不阻塞"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 class Photo(db.Model):
     __tablename__ = 'photos'
+    __table_args__ = (
+        # 分类内按文件名排序、扫描时的存在性查询、分类列表都走这个索引；同一分类下文件名唯一
+        db.Index('ix_photos_category_filename', 'category', 'filename', unique=True),
+        # “全部照片”按文件名排序
+        db.Index('ix_photos_filename', 'filename'),
+        # 按拍摄时间排序 / 按日期范围筛选（全部照片、分类内）
+        db.Index('ix_photos_taken_at', 'taken_at', 'id'),
+        db.Index('ix_photos_category_taken_at', 'category', 'taken_at', 'id'),
+        # 重复照片查询（按内容摘要分组）
+        db.Index('ix_photos_content_hash', 'content_hash'),
+        # 相似照片查询：感知哈希的 4 个 16 位分段各建一个索引（见 similarity.py）
+        db.Index('ix_photos_phash_b0', 'phash_b0'),
+        db.Index('ix_photos_phash_b1', 'phash_b1'),
+        db.Index('ix_photos_phash_b2', 'phash_b2'),
+        db.Index('ix_photos_phash_b3', 'phash_b3'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)  # 照片标题
@@ -14,16 +49,46 @@ class Photo(db.Model):
     filename = db.Column(db.String(255), nullable=False)  # 原图文件名
     thumbnail = db.Column(db.String(255), nullable=True)  # 缩略图文件名（可选，默认同原图）
     category = db.Column(db.String(100), nullable=False)  # 分类（对应文件夹名）
+    thumb_version = db.Column(db.String(16), nullable=True)  # 缩略图版本号（原图变化后改变）
+    # 以下由扫描从 EXIF 中读取
+    taken_at = db.Column(db.DateTime, nullable=True)      # 拍摄时间（相机本地时间；没有 EXIF 时为文件修改时间）
+    width = db.Column(db.Integer, nullable=True)          # 显示宽度（已按方向旋转）
+    height = db.Column(db.Integer, nullable=True)         # 显示高度
+    orientation = db.Column(db.SmallInteger, nullable=True)  # EXIF 方向（1~8）
+    camera = db.Column(db.String(100), nullable=True)     # 相机厂商和型号
+    latitude = db.Column(db.Float, nullable=True)         # GPS 纬度（十进制度，南纬为负）
+    longitude = db.Column(db.Float, nullable=True)        # GPS 经度（十进制度，西经为负）
+    content_hash = db.Column(db.String(32), nullable=True)  # 原图内容摘要（BLAKE2b-128），相同即为重复照片
+    phash = db.Column(db.BigInteger, nullable=True)       # 感知哈希（64 位 dHash，按有符号整数存储）
+    phash_b0 = db.Column(db.Integer, nullable=True)       # 感知哈希的 4 个 16 位分段（低位在前）
+    phash_b1 = db.Column(db.Integer, nullable=True)
+    phash_b2 = db.Column(db.Integer, nullable=True)
+    phash_b3 = db.Column(db.Integer, nullable=True)
+    placeholder = db.Column(db.Text, nullable=True)       # 16px 占位图（base64 JPEG data URI）
 
     def to_dict(self):
         """转换为字典，供前端API使用"""
+        thumbnail = self.thumbnail or self.filename  # 默认使用原图文件名
+        if self.thumb_version:
+            # 带版本号的缩略图 URL 可被浏览器长期缓存
+            thumbnail = f"{thumbnail}?v={self.thumb_version}"
         return {
             'id': self.id,
             'title': self.title,
             'description': self.description,
             'filename': self.filename,
-            'thumbnail': self.thumbnail or self.filename,  # 默认使用原图文件名
-            'category': self.category
+            'thumbnail': thumbnail,
+            'version': self.thumb_version,  # 衍生图 URL 使用同一版本号
+            'category': self.category,
+            'taken_at': self.taken_at.isoformat() if self.taken_at else None,
+            'width': self.width,
+            'height': self.height,
+            'placeholder': self.placeholder,  # 缩略图加载前显示，前端按 width / height 预留版面
+            'orientation': self.orientation,
+            'camera': self.camera,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'content_hash': self.content_hash
         }
     
     def delete_files(self):
@@ -52,13 +117,363 @@ class Photo(db.Model):
                 except Exception as e:
                     logger.error(f"删除原图失败 ({photo_path}): {str(e)}")
 
-        # 删除缩略图
+        # 删除缩略图（旧版同名缩略图及各格式版本）
         if (self.thumbnail or self.filename) and self.category:
             thumb_filename = self.thumbnail or self.filename
             thumb_path = safe_join(current_app.config['THUMBNAIL_FOLDER'], self.category, thumb_filename)
-            if thumb_path and os.path.exists(thumb_path) and os.path.isfile(thumb_path):
-                try:
-                    os.remove(thumb_path)
-                    logger.info(f"已删除缩略图: {thumb_path}")
-                except Exception as e:
-                    logger.error(f"删除缩略图失败 ({thumb_path}): {str(e)}")
\ No newline at end of file
+            if not thumb_path:
+                return
+            formats = current_app.config.get('THUMBNAIL_OUTPUT_FORMATS', ())
+            for path in [thumb_path] + [variant_path(thumb_path, fmt) for fmt in formats]:
+                if os.path.exists(path) and os.path.isfile(path):
+                    try:
+                        os.remove(path)
+                        logger.info(f"已删除缩略图: {path}")
+                    except Exception as e:
+                        logger.error(f"删除缩略图失败 ({path}): {str(e)}")
+
+
+@event.listens_for(Photo.__table__, "after_create")
+def _create_photo_search_index(target, connection, **kw):
+    """新建 photos 表时一并创建全文索引（已有数据库由迁移创建）"""
+    create_search_index(connection)
+
+
+class PhotoManifest(db.Model):
+    """扫描清单：记录上次扫描时每个原图文件的状态，用于增量扫描
+
+    无法解码的文件也登记（failed 为真），文件不变时后续扫描直接跳过，变化后才重新处理。
+    """
+    __tablename__ = 'photo_manifest'
+    __table_args__ = (
+        db.UniqueConstraint('category', 'filename', name='uq_photo_manifest_category_filename'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(100), nullable=False)  # 分类（对应文件夹名）
+    filename = db.Column(db.String(255), nullable=False)  # 原图文件名
+    size = db.Column(db.BigInteger, nullable=False)       # 文件大小（字节）
+    mtime_ns = db.Column(db.BigInteger, nullable=False)   # 修改时间（纳秒）
+    inode = db.Column(db.BigInteger, nullable=False)      # inode（Windows 下为文件索引号）
+    failed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # 处理失败（不计入分类统计）
+
+
+class CategoryStats(db.Model):
+    """分类统计：照片数、原图总大小、最新修改时间和封面照片（最新的一张）
+
+    由扫描在每个检查点增量维护（见 CategoryStatsDelta），读取时无需聚合查询。
+    """
+    __tablename__ = 'category_stats'
+
+    category = db.Column(db.String(100), primary_key=True)
+    photo_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    newest_mtime_ns = db.Column(db.BigInteger, nullable=True)
+    cover_photo_id = db.Column(db.Integer, nullable=True)
+
+    def to_dict(self):
+        return {
+            'category': self.category,
+            'count': self.photo_count,
+            'total_bytes': self.total_bytes,
+            'newest_mtime': self.newest_mtime_ns / 1e9 if self.newest_mtime_ns else None,
+            'cover_photo_id': self.cover_photo_id
+        }
+
+
+# 按分类重新统计：照片数来自 photos，大小和修改时间来自清单；
+# SQLite 中与唯一的 MAX() 同查的裸列取自最大值所在的行，即最新照片的 id
+_CATEGORY_STATS_SQL = """
+    SELECT p.category, COUNT(p.id), COALESCE(SUM(m.size), 0), MAX(m.mtime_ns), p.id
+    FROM photos p
+    LEFT JOIN photo_manifest m ON m.category = p.category AND m.filename = p.filename AND m.failed = 0
+    {where}
+    GROUP BY p.category
+"""
+
+
+def refresh_category_stats(connection, categories=None):
+    """重新统计指定分类（None 表示全部），connection 可以是 Session 或 Connection，不提交"""
+    if categories is None:
+        connection.execute(text("DELETE FROM category_stats"))
+        rows = connection.execute(text(_CATEGORY_STATS_SQL.format(where=''))).fetchall()
+    else:
+        categories = list(categories)
+        if not categories:
+            return
+        connection.execute(
+            text("DELETE FROM category_stats WHERE category IN :categories")
+            .bindparams(bindparam('categories', expanding=True)),
+            {'categories': categories}
+        )
+        rows = connection.execute(
+            text(_CATEGORY_STATS_SQL.format(where='WHERE p.category IN :categories'))
+            .bindparams(bindparam('categories', expanding=True)),
+            {'categories': categories}
+        ).fetchall()
+    if rows:
+        connection.execute(
+            text("INSERT INTO category_stats (category, photo_count, total_bytes, newest_mtime_ns, cover_photo_id) "
+                 "VALUES (:category, :count, :bytes, :newest, :cover)"),
+            [{'category': category, 'count': count, 'bytes': total, 'newest': newest, 'cover': cover}
+             for category, count, total, newest, cover in rows]
+        )
+
+
+class CategoryStatsDelta:
+    """扫描一个批次内各分类统计的变化量，在批次提交前用 apply() 写入 category_stats
+
+    被替换（原图变化）或删除的清单条目须在改写前调用 files_replaced，以便扣除旧的大小；
+    若被扣除的正是分类中最新的文件，该分类在 apply() 时重新统计。
+    """
+
+    def __init__(self):
+        self._changes = {}
+
+    def _entry(self, category):
+        entry = self._changes.get(category)
+        if entry is None:
+            entry = self._changes[category] = {'count': 0, 'bytes': 0, 'newest': None, 'lost_mtime': None,
+                                               'recount': False}
+        return entry
+
+    def recount(self, category):
+        """无法增量计算的变化（如删除没有清单条目的照片，其大小未知且可能是封面），apply() 时重新统计该分类"""
+        self._entry(category)['recount'] = True
+
+    def photo_added(self, category):
+        self._entry(category)['count'] += 1
+
+    def photos_removed(self, categories):
+        for category in categories:
+            self._entry(category)['count'] -= 1
+
+    def file_added(self, category, filename, size, mtime_ns):
+        entry = self._entry(category)
+        entry['bytes'] += size
+        if entry['newest'] is None or mtime_ns >= entry['newest'][0]:
+            entry['newest'] = (mtime_ns, filename)
+
+    def files_replaced(self, manifest_ids):
+        """扣除即将被改写或删除的清单条目（按 id）的旧大小；处理失败的条目未计入统计，跳过"""
+        manifest_ids = list(manifest_ids)
+        for start in range(0, len(manifest_ids), 500):
+            rows = db.session.query(PhotoManifest.category, PhotoManifest.size, PhotoManifest.mtime_ns) \
+                .filter(PhotoManifest.id.in_(manifest_ids[start:start + 500]), PhotoManifest.failed.is_(False))
+            for category, size, mtime_ns in rows:
+                entry = self._entry(category)
+                entry['bytes'] -= size
+                if entry['lost_mtime'] is None or mtime_ns > entry['lost_mtime']:
+                    entry['lost_mtime'] = mtime_ns
+
+    def apply(self):
+        """把变化量写入 category_stats（不提交），须在本批次的照片和清单写入之后调用"""
+        recompute = []
+        for category, change in self._changes.items():
+            stats = db.session.get(CategoryStats, category)
+            if stats is None:
+                stats = CategoryStats(category=category, photo_count=0, total_bytes=0)
+                db.session.add(stats)
+            newest = change['newest']
+            lost = change['lost_mtime']
+            if change['recount'] or (lost is not None and stats.newest_mtime_ns is not None
+                                     and lost >= stats.newest_mtime_ns and (newest is None or newest[0] < lost)):
+                # 最新的文件被删除或替换（或有无法增量计算的变化），无法增量得出新的统计
+                recompute.append(category)
+                continue
+
+            stats.photo_count += change['count']
+            stats.total_bytes += change['bytes']
+            if newest and (stats.newest_mtime_ns is None or newest[0] >= stats.newest_mtime_ns):
+                stats.newest_mtime_ns = newest[0]
+                stats.cover_photo_id = db.session.query(Photo.id).filter(
+                    Photo.category == category, Photo.filename == newest[1]
+                ).scalar()
+            if stats.photo_count <= 0:
+                db.session.delete(stats)
+
+        if recompute:
+            db.session.flush()
+            refresh_category_stats(db.session, recompute)
+            # 重新统计直接写表，丢弃会话中可能过期的对象
+            for category in recompute:
+                stats = db.session.get(CategoryStats, category)
+                if stats is not None:
+                    db.session.expire(stats)
+        self._changes.clear()
+
+
+class SchemaInfo(db.Model):
+    """键值元数据表：数据库结构版本号、扫描状态等"""
+    __tablename__ = 'schema_info'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=True)
+
+    @classmethod
+    def get_value(cls, key, default=None):
+        row = db.session.get(cls, key)
+        return row.value if row else default
+
+    @classmethod
+    def set_value(cls, key, value):
+        """写入元数据（不提交，由调用方提交）"""
+        row = db.session.get(cls, key)
+        if row:
+            row.value = str(value)
+        else:
+            db.session.add(cls(key=key, value=str(value)))
+
+
+class ScanJob(db.Model):
+    """扫描任务：所有进程共享的扫描状态、进度、耗时和结果统计
+
+    状态：running（进行中）、complete（完成）、interrupted（收到停止请求，已提交检查点）、
+    failed（出错）、abandoned（扫描进程已异常退出：心跳超时，或新进程获得后台任务锁时仍为 running）。
+    同一时刻最多只有一个心跳未过期的 running 任务，由 claim 保证。
+    """
+    __tablename__ = 'scan_jobs'
+    __table_args__ = (
+        db.Index('ix_scan_jobs_state', 'state'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    state = db.Column(db.String(16), nullable=False)
+    owner = db.Column(db.String(64), nullable=False)         # 执行扫描的进程（主机名:进程号）
+    started_at = db.Column(db.Float, nullable=False)         # 时间均为 Unix 时间戳（秒）
+    heartbeat_at = db.Column(db.Float, nullable=False)
+    finished_at = db.Column(db.Float, nullable=True)
+    total = db.Column(db.Integer, nullable=False, default=0)      # 需要处理的照片数
+    processed = db.Column(db.Integer, nullable=False, default=0)  # 已处理数
+    committed = db.Column(db.Integer, nullable=False, default=0)  # 已提交（可续扫）数
+    batches = db.Column(db.Integer, nullable=False, default=0)    # 已提交批次数
+    new_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    removed_count = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255), nullable=True)
+
+    HISTORY_SIZE = 100  # 保留最近的任务记录条数
+
+    @classmethod
+    def claim(cls, owner, stale_after):
+        """尝试创建一个 running 任务并提交，返回任务 id；已有进行中的任务时返回 None
+
+        先把心跳超时的 running 任务标记为 abandoned，再用 INSERT ... SELECT ... WHERE NOT EXISTS
+        在同一个写事务中插入，多个进程同时调用时只有一个能成功。
+        """
+        table = cls.__table__
+        now = time.time()
+        try:
+            db.session.execute(
+                table.update()
+                .where(table.c.state == 'running', table.c.heartbeat_at < now - stale_after)
+                .values(state='abandoned', finished_at=now, message='扫描进程心跳超时')
+            )
+            active = select(table.c.id).where(table.c.state == 'running').exists()
+            inserted = db.session.execute(table.insert().from_select(
+                ['state', 'owner', 'started_at', 'heartbeat_at'],
+                select(literal('running'), literal(owner), literal(now), literal(now)).where(~active)
+            )).rowcount
+            db.session.commit()
+        except OperationalError as e:
+            # 并发写入冲突（数据库忙），视为其他进程已在扫描
+            db.session.rollback()
+            logger.warning(f"创建扫描任务失败: {str(e)}")
+            return None
+        if not inserted:
+            return None
+        return db.session.query(cls.id).filter_by(state='running', owner=owner) \
+            .order_by(cls.id.desc()).limit(1).scalar()
+
+    @classmethod
+    def abandon_others(cls, owner):
+        """把不属于 owner 的 running 任务标记为 abandoned 并提交，返回标记的任务数
+
+        只在获得后台任务锁后调用：扫描只在持锁进程中运行，锁随进程退出释放，
+        此时其他进程名下的 running 任务已经没有进程在执行（被强制结束，未能记录结束状态），
+        不必等心跳超时即可重新扫描。
+        """
+        table = cls.__table__
+        now = time.time()
+        abandoned = db.session.execute(
+            table.update()
+            .where(table.c.state == 'running', table.c.owner != owner)
+            .values(state='abandoned', finished_at=now, message='扫描进程已退出')
+        ).rowcount
+        db.session.commit()
+        return abandoned
+
+    @classmethod
+    def active(cls, stale_after):
+        """当前进行中且心跳未过期的任务，没有时返回 None"""
+        return cls.query.filter(
+            cls.state == 'running', cls.heartbeat_at >= time.time() - stale_after
+        ).order_by(cls.id.desc()).first()
+
+    @classmethod
+    def latest(cls):
+        return cls.query.order_by(cls.id.desc()).first()
+
+    @classmethod
+    def heartbeat(cls, job_id):
+        """刷新心跳并提交"""
+        table = cls.__table__
+        db.session.execute(
+            table.update().where(table.c.id == job_id, table.c.state == 'running').values(heartbeat_at=time.time())
+        )
+        db.session.commit()
+
+    @classmethod
+    def record_progress(cls, job_id, progress):
+        """写入进度并刷新心跳（不提交，与扫描检查点在同一事务中提交）"""
+        table = cls.__table__
+        db.session.execute(table.update().where(table.c.id == job_id).values(
+            total=progress.get('total', 0),
+            processed=progress.get('processed', 0),
+            committed=progress.get('committed', 0),
+            batches=progress.get('batches', 0),
+            heartbeat_at=time.time()
+        ))
+
+    @classmethod
+    def finish(cls, job_id, state, result):
+        """记录任务结束状态和结果统计并提交，同时清理过旧的历史记录"""
+        table = cls.__table__
+        db.session.execute(table.update().where(table.c.id == job_id).values(
+            state=state,
+            finished_at=time.time(),
+            new_count=result.get('new', 0),
+            updated_count=result.get('updated', 0),
+            removed_count=result.get('removed', 0),
+            error_count=result.get('errors', 0),
+            message=(result.get('message') or '')[:255]
+        ))
+        db.session.execute(table.delete().where(table.c.id <= job_id - cls.HISTORY_SIZE))
+        db.session.commit()
+
+    def progress_dict(self):
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'committed': self.committed,
+            'batches': self.batches
+        }
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'state': self.state,
+            'owner': self.owner,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'heartbeat_at': self.heartbeat_at,
+            'duration': round(end - self.started_at, 3),
+            'progress': self.progress_dict(),
+            'new': self.new_count,
+            'updated': self.updated_count,
+            'removed': self.removed_count,
+            'errors': self.error_count,
+            'message': self.message
+        }
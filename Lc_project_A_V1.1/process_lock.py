@@ -0,0 +1,84 @@
+"""跨进程文件锁
+
+多进程部署（gunicorn 多 worker 等）时用来保证：数据库迁移同一时刻只有一个进程执行，
+启动扫描和目录监视只在一个进程（持有后台任务锁的进程）中运行。
+锁由操作系统在进程退出（包括崩溃）时自动释放，不会残留。
+"""
+import os
+import sys
+import time
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+
+class InterProcessLock:
+    """基于锁文件的互斥锁：POSIX 使用 flock，Windows 使用 msvcrt.locking"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True, poll_interval=0.1):
+        """获取锁；blocking 为 False 时立即返回是否获取成功"""
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                self._lock(fd)
+                break
+            except OSError:
+                if not blocking:
+                    os.close(fd)
+                    return False
+                time.sleep(poll_interval)
+
+        # 记录持有者进程号，便于排查
+        try:
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+        except OSError:
+            pass
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            self._unlock(fd)
+        except OSError:
+            pass
+        os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+    if sys.platform == 'win32':
+        @staticmethod
+        def _lock(fd):
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+        @staticmethod
+        def _unlock(fd):
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        @staticmethod
+        def _lock(fd):
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        @staticmethod
+        def _unlock(fd):
+            fcntl.flock(fd, fcntl.LOCK_UN)
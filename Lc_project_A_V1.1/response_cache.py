@@ -0,0 +1,47 @@
+"""进程内 API 响应缓存
+
+缓存序列化好的 JSON 响应体，按最近使用顺序淘汰，条目超过 ttl 秒或索引版本号变化后失效。
+索引版本号保存在数据库中、随扫描检查点一起提交，多进程部署时各进程的缓存都会跟着失效。
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """有界 LRU + TTL 缓存：键 -> (索引版本号, 过期时间, ETag, 响应体)"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_etag(body):
+        # 由响应体计算：内容相同则各进程给出的 ETag 相同
+        return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+    def get(self, key, generation):
+        """返回 (ETag, 响应体)；未命中、已过期或索引版本号不同时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_generation, expires, etag, body = entry
+            if entry_generation != generation or expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return etag, body
+
+    def put(self, key, generation, body):
+        """保存响应体并返回 (ETag, 响应体)"""
+        etag = self.make_etag(body)
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic() + self.ttl, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
@@ -0,0 +1,217 @@
+"""照片标题 / 描述全文检索（SQLite FTS5）
+
+photos_fts 是以 photos 为外部内容表的 FTS5 虚拟表，由触发器随 photos 的增删改同步。
+优先使用 trigram 分词器（SQLite 3.34+）：中文标题没有空格分词，按三字组索引后任意位置的
+子串都能命中（也就覆盖了前缀匹配）。SQLite 不支持 trigram 时使用 unicode61 分词器，检索词按前缀匹配。
+
+三字组索引查不了不足三个字的检索词（中文多为两字词，如“小猫”），这类检索词由 photo_grams 查找：
+它是另一张无内容（contentless）的 FTS5 表，由触发器把标题和描述中的每个字、每两个相邻字的组合
+写成一个个词元（UTF-8 的十六进制，避免分词器再切分标点和中文），检索词按同样方式编码后精确匹配。
+不保存位置信息（detail=none），索引大小约为三字组索引的六成。
+
+bm25 需要为每条命中结果计算得分，宽泛的检索词（命中数万条）排序代价与命中数成正比，
+因此只在命中数不超过 RANK_LIMIT 时按相关度排序，否则按全文索引自身的 rowid 顺序分页。
+"""
+from sqlalchemy import Table, Column, Integer, Text, MetaData, text, literal_column, or_
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = 'photos_fts'
+
+# 按偏好顺序尝试的分词器
+FTS_TOKENIZERS = ('trigram', 'unicode61 remove_diacritics 2')
+
+TRIGRAM_MIN_LENGTH = 3
+
+RANK_LIMIT = 1000  # 命中数不超过该值时按 bm25 相关度排序
+
+CREATE_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS photos_fts USING fts5("
+    "title, description, content='photos', content_rowid='id', tokenize='{tokenizer}')"
+)
+
+# 外部内容表需要触发器同步；只在标题、描述变化时更新索引（扫描更新缩略图版本号不触发）
+FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_ai AFTER INSERT ON photos BEGIN
+        INSERT INTO photos_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_ad AFTER DELETE ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS photos_fts_au AFTER UPDATE OF title, description ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO photos_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+)
+
+GRAM_TABLE = 'photo_grams'
+GRAM_MAX_POSITION = 10000  # 只为标题 / 描述的前这么多字建立单字 / 二字索引（search_positions 的行数）
+
+CREATE_GRAM_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS photo_grams USING fts5("
+    "grams, content='', detail=none, columnsize=0, tokenize='ascii')",
+    # 触发器中不能使用 WITH RECURSIVE，按位置拆字借助一张序号表
+    "CREATE TABLE IF NOT EXISTS search_positions (n INTEGER NOT NULL PRIMARY KEY)",
+)
+
+
+def _grams_sql(column):
+    """SQL 表达式：某个文本字段的全部单字和二字组合，每个组合编码为十六进制，空格分隔
+
+    lower 与 _fold 一致，只转换 ASCII 字母；字段为 NULL 时得到空字符串。
+    """
+    return (f"coalesce((SELECT group_concat(hex(lower(substr({column}, p.n, w.k))), ' ') "
+            f"FROM search_positions AS p JOIN (SELECT 1 AS k UNION ALL SELECT 2) AS w "
+            f"WHERE p.n <= length({column})), '')")
+
+
+def _row_grams(row):
+    return f"{_grams_sql(row + '.title')} || ' ' || {_grams_sql(row + '.description')}"
+
+
+# 无内容表删除时须给出与写入时相同的词元，由旧的标题和描述重新计算
+GRAM_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS photo_grams_ai AFTER INSERT ON photos BEGIN
+        INSERT INTO photo_grams(rowid, grams) VALUES (new.id, {_row_grams('new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photo_grams_ad AFTER DELETE ON photos BEGIN
+        INSERT INTO photo_grams(photo_grams, rowid, grams) VALUES ('delete', old.id, {_row_grams('old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photo_grams_au AFTER UPDATE OF title, description ON photos BEGIN
+        INSERT INTO photo_grams(photo_grams, rowid, grams) VALUES ('delete', old.id, {_row_grams('old')});
+        INSERT INTO photo_grams(rowid, grams) VALUES (new.id, {_row_grams('new')});
+    END""",
+)
+
+# 供 ORM 查询联表使用，不加入 db.metadata（create_all 不创建它们）
+photos_fts = Table(
+    FTS_TABLE, MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('title', Text),
+    Column('description', Text),
+)
+
+photo_grams = Table(
+    GRAM_TABLE, MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('grams', Text),
+)
+
+
+def create_gram_index(connection):
+    """创建 photo_grams、序号表和同步触发器，并按 photos 现有内容重建索引
+
+    SQLite 未编译 FTS5 时返回 False（不足三个字的检索词退回 LIKE）。
+    """
+    try:
+        for sql in CREATE_GRAM_SQL:
+            connection.execute(text(sql))
+    except OperationalError:
+        return False
+    connection.execute(text(
+        "WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :limit) "
+        "INSERT OR IGNORE INTO search_positions (n) SELECT n FROM seq"
+    ), {'limit': GRAM_MAX_POSITION})
+    for trigger in GRAM_TRIGGERS:
+        connection.execute(text(trigger))
+    connection.execute(text("INSERT INTO photo_grams(photo_grams) VALUES ('delete-all')"))
+    connection.execute(text(f"INSERT INTO photo_grams(rowid, grams) SELECT id, {_row_grams('photos')} FROM photos"))
+    return True
+
+
+def create_search_index(connection):
+    """创建 photos_fts、photo_grams 及同步触发器，并按 photos 现有内容重建索引
+
+    返回使用的分词器名称；SQLite 未编译 FTS5 时返回 None（检索退回 LIKE）。
+    """
+    create_gram_index(connection)
+    for tokenizer in FTS_TOKENIZERS:
+        try:
+            connection.execute(text(CREATE_FTS_SQL.format(tokenizer=tokenizer)))
+        except OperationalError:
+            continue
+        for trigger in FTS_TRIGGERS:
+            connection.execute(text(trigger))
+        connection.execute(text("INSERT INTO photos_fts(photos_fts) VALUES ('rebuild')"))
+        return tokenizer.split()[0]
+    return None
+
+
+def detect_tokenizer(connection):
+    """读取 photos_fts 使用的分词器，没有全文索引时返回 None"""
+    sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+    ).scalar()
+    if not sql:
+        return None
+    return 'trigram' if 'trigram' in sql else 'unicode61'
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _fold(term):
+    """与 SQLite 内置 lower() 相同，只把 ASCII 字母转为小写"""
+    return ''.join(char.lower() if char.isascii() else char for char in term)
+
+
+def _gram_token(term):
+    """检索词（一或两个字）-> photo_grams 中的词元，与 _grams_sql 的编码一致"""
+    return _fold(term).encode('utf-8').hex().upper()
+
+
+def apply_search(query, model, q, tokenizer):
+    """为照片查询加上检索条件（不排序），返回 (查询, 使用的索引)
+
+    使用的索引为 'fts'（全文索引）、'grams'（只用了单字 / 二字索引）或 None（只用了 LIKE）。
+    空格分隔的多个检索词之间为 AND 关系。有全文索引时，不足三个字的检索词合成一个
+    photo_grams 的 MATCH 表达式，其余检索词合成一个 photos_fts 的 MATCH 表达式；
+    没有全文索引时全部用 LIKE 匹配。
+    """
+    terms = q.split()
+    if tokenizer:
+        short = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH]
+        terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+    else:
+        short = []
+    if tokenizer == 'trigram':
+        match = ' '.join(_quote(term) for term in terms)
+    elif tokenizer:
+        match = ' '.join(_quote(term) + '*' for term in terms)
+    else:
+        match = ''
+        for term in terms:
+            pattern = _like_pattern(term)
+            query = query.filter(or_(model.title.like(pattern, escape='\\'),
+                                     model.description.like(pattern, escape='\\')))
+
+    if short:
+        grams = literal_column(GRAM_TABLE)
+        query = query.join(photo_grams, photo_grams.c.rowid == model.id).filter(
+            grams.match(' '.join(_quote(_gram_token(term)) for term in short)))
+    if match:
+        fts = literal_column(FTS_TABLE)
+        query = query.join(photos_fts, photos_fts.c.rowid == model.id).filter(fts.match(match))
+        return query, 'fts'
+    if short:
+        return query, 'grams'
+    return query, None
+
+
+def order_search(query, model, total, index):
+    """为使用了索引的检索排序（index 见 apply_search）
+
+    全文索引：命中数不超过 RANK_LIMIT 时按 bm25（标题权重高于描述），否则按 rowid；
+    只用了单字 / 二字索引时按 photo_grams 的 rowid（即照片 id），与索引自身的顺序一致，不需要对全部命中排序。
+    """
+    if index == 'grams':
+        return query.order_by(photo_grams.c.rowid)
+    if total <= RANK_LIMIT:
+        return query.order_by(literal_column(f"bm25({FTS_TABLE}, 10.0, 1.0)"), model.id)
+    return query.order_by(photos_fts.c.rowid)
@@ -0,0 +1,79 @@
+"""相似照片检索（感知哈希 + 多索引汉明查找）
+
+扫描时由缩略图计算 64 位 dHash（见 thumbnailer.dhash），连拍、重新导出、轻微裁剪调色的照片哈希值只差几位。
+哈希按 16 位切成 4 段，每段单独建索引：两个哈希的汉明距离不超过 d 时，按抽屉原理至少有一段
+相差不超过 d // 4 位。查询时对每一段枚举这个半径内的所有取值，用 4 个索引的 IN 查找取出候选，
+只对候选计算完整的汉明距离，不需要与全部照片逐一比较。
+"""
+from itertools import combinations
+from sqlalchemy import or_
+
+HASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+BAND_MASK = (1 << BAND_BITS) - 1
+
+DEFAULT_MAX_DISTANCE = 10
+MAX_DISTANCE = 11  # 每段枚举半径 2（137 个取值）；半径 3 时候选数增加约 5 倍
+
+BAND_COLUMNS = tuple(f"phash_b{i}" for i in range(BAND_COUNT))
+
+
+def _to_signed(value):
+    # SQLite INTEGER 为有符号 64 位
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def _to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def split_bands(value):
+    """64 位哈希 -> 4 个 16 位分段（低位在前）"""
+    value = _to_unsigned(value)
+    return [(value >> (i * BAND_BITS)) & BAND_MASK for i in range(BAND_COUNT)]
+
+
+def phash_columns(value):
+    """感知哈希（无符号整数或 None）-> photos 表中 phash 及各分段字段的取值"""
+    if value is None:
+        return dict.fromkeys(('phash',) + BAND_COLUMNS)
+    columns = {'phash': _to_signed(value)}
+    columns.update(zip(BAND_COLUMNS, split_bands(value)))
+    return columns
+
+
+def hamming_distance(a, b):
+    return bin(_to_unsigned(a) ^ _to_unsigned(b)).count('1')
+
+
+def band_neighbors(band, radius):
+    """与某一段相差不超过 radius 位的所有 16 位取值"""
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), flips):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def similar_condition(model, phash, max_distance):
+    """候选条件：至少有一段落在枚举半径内（每段走各自的索引，SQLite 对 OR 使用多索引查找）"""
+    radius = max_distance // BAND_COUNT
+    return or_(*[
+        getattr(model, column).in_(band_neighbors(band, radius))
+        for column, band in zip(BAND_COLUMNS, split_bands(phash))
+    ])
+
+
+def rank_similar(candidates, phash, max_distance, limit):
+    """对候选 [(id, 哈希)] 计算汉明距离，返回距离不超过 max_distance 的前 limit 个 [(距离, id)]"""
+    matches = []
+    for photo_id, other in candidates:
+        distance = hamming_distance(phash, other)
+        if distance <= max_distance:
+            matches.append((distance, photo_id))
+    matches.sort()
+    return matches[:limit]
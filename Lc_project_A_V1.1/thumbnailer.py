@@ -0,0 +1,487 @@
+import io
+import os
+import math
+import base64
+import mmap
+import shutil
+import hashlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps, ExifTags, features
+
+
+# 解码阶段保留的冗余倍数：先粗缩到目标尺寸的 2 倍以上，再用高质量滤波精确缩放
+REDUCING_GAP = 2.0
+
+# 单个文件本身的问题（读取失败、损坏截断、不支持的格式、像素过多、写入失败），计为该文件失败；
+# 其他异常属于程序错误，向上抛出使整次扫描失败，而不是把每张照片都记成坏图
+IMAGE_ERRORS = (OSError, SyntaxError, ValueError, MemoryError, Image.DecompressionBombError)
+
+# 可以直接缩放的模式；其余模式（调色板、1 位等）需先转换，否则缩放会退化为最近邻
+_RESIZABLE_MODES = ('RGB', 'L', 'RGBA', 'LA', 'CMYK')
+
+
+# 缩略图输出格式：文件扩展名、MIME 类型和编码参数。按 variant_path 存放为 <文件名>.<扩展名>
+THUMBNAIL_FORMATS = {
+    'avif': ('.avif', 'image/avif', {'format': 'AVIF', 'quality': 60, 'speed': 6}),
+    'webp': ('.webp', 'image/webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'jpeg': ('.jpg', 'image/jpeg', {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def supported_formats(preferred):
+    """按偏好顺序过滤出当前 Pillow 能编码的格式，JPEG 始终作为兜底放在最后"""
+    result = []
+    for fmt in preferred:
+        if fmt == 'jpeg' or fmt in result or fmt not in THUMBNAIL_FORMATS:
+            continue
+        try:
+            available = features.check(fmt)
+        except ValueError:
+            # 旧版 Pillow 不认识该特性名
+            available = False
+        if available:
+            result.append(fmt)
+    result.append('jpeg')
+    return result
+
+
+def variant_path(base_path, fmt):
+    """某种输出格式的缩略图路径：<原图同名>.<格式扩展名>"""
+    return base_path + THUMBNAIL_FORMATS[fmt][0]
+
+
+def thumbnail_mimetype(fmt):
+    return THUMBNAIL_FORMATS[fmt][1]
+
+
+def thumbnail_version(size, mtime_ns, orientation=None):
+    """缩略图版本号：由原图大小和修改时间得出，原图变化后缩略图 URL 随之变化
+
+    带 EXIF 方向（非 1）的照片额外计入方向：缩略图改为按方向旋转后，这些照片的 URL 随之变化，
+    浏览器不会继续使用缓存中未旋转的旧缩略图；其余照片的版本号不变。
+    """
+    key = f"{size}:{mtime_ns}"
+    if orientation and orientation != 1:
+        key += f":o{orientation}"
+    return hashlib.blake2s(key.encode(), digest_size=6).hexdigest()
+
+
+# 扫描时随缩略图一起提取的信息（EXIF 和内容摘要）；读取失败或缺失的项为 None
+METADATA_FIELDS = ('taken_at', 'width', 'height', 'orientation', 'camera', 'latitude', 'longitude',
+                   'content_hash', 'phash', 'placeholder')
+
+_EXIF_DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+def _parse_exif_datetime(value):
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'ignore')
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip().rstrip('\x00')[:19], _EXIF_DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'ignore')
+    return value.strip().strip('\x00').strip() if isinstance(value, str) else ''
+
+
+def _gps_degrees(values, ref):
+    """(度, 分, 秒) 有理数 + 方位参考 -> 带符号的十进制度数"""
+    try:
+        degrees = float(values[0]) + float(values[1]) / 60 + float(values[2]) / 3600
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        return None
+    if not math.isfinite(degrees) or degrees > 180:
+        # 分母为 0 的有理数会得到 nan
+        return None
+    if _exif_text(ref).upper() in ('S', 'W'):
+        degrees = -degrees
+    return round(degrees, 7)
+
+
+def read_metadata(img):
+    """从已打开（尚未 draft 缩小）的图像读取尺寸和 EXIF：拍摄时间、方向、相机型号、GPS
+
+    只解析文件头中的 EXIF，不解码像素。宽高为按 EXIF 方向旋转后的显示尺寸。
+    """
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    width, height = img.size
+    try:
+        exif = img.getexif()
+    except Exception:
+        exif = None
+
+    if exif:
+        try:
+            exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        except Exception:
+            exif_ifd = {}
+        metadata['taken_at'] = (_parse_exif_datetime(exif_ifd.get(ExifTags.Base.DateTimeOriginal))
+                                or _parse_exif_datetime(exif_ifd.get(ExifTags.Base.DateTimeDigitized))
+                                or _parse_exif_datetime(exif.get(ExifTags.Base.DateTime)))
+
+        orientation = exif.get(ExifTags.Base.Orientation)
+        if isinstance(orientation, int) and 1 <= orientation <= 8:
+            metadata['orientation'] = orientation
+            if orientation >= 5:
+                # 5~8 表示需要旋转 90°，显示时宽高互换
+                width, height = height, width
+
+        make = _exif_text(exif.get(ExifTags.Base.Make))
+        model = _exif_text(exif.get(ExifTags.Base.Model))
+        camera = model if make and model.lower().startswith(make.lower()) else f"{make} {model}".strip()
+        metadata['camera'] = camera[:100] or None
+
+        try:
+            gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+        except Exception:
+            gps = {}
+        if gps.get(ExifTags.GPS.GPSLatitude) and gps.get(ExifTags.GPS.GPSLongitude):
+            metadata['latitude'] = _gps_degrees(gps[ExifTags.GPS.GPSLatitude], gps.get(ExifTags.GPS.GPSLatitudeRef))
+            metadata['longitude'] = _gps_degrees(gps[ExifTags.GPS.GPSLongitude], gps.get(ExifTags.GPS.GPSLongitudeRef))
+
+    metadata['width'] = width
+    metadata['height'] = height
+    return metadata
+
+
+DHASH_SIZE = 8  # 8x8 个相邻像素比较 -> 64 位
+
+
+def dhash(img):
+    """64 位差值哈希（dHash）：灰度缩到 9x8，逐行比较相邻像素的明暗
+
+    输入应是已缩小的图像（缩略图），计算量可以忽略。
+    """
+    small = img.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+PLACEHOLDER_SIZE = 16  # 占位图最长边（像素）
+
+
+def placeholder(img):
+    """极小的 JPEG 占位图（data URI），前端在缩略图加载完成前模糊放大显示"""
+    small = img.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    if small.mode not in ('RGB', 'L'):
+        small = small.convert('RGB')
+    buffer = io.BytesIO()
+    small.save(buffer, format='JPEG', quality=40, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _fingerprints(img):
+    """由已缩小的图像计算感知哈希和占位图"""
+    return {'phash': dhash(img), 'placeholder': placeholder(img)}
+
+
+def _thumbnail_fingerprints(base):
+    """从已有的 JPEG 缩略图计算感知哈希和占位图（不解码原图），读取失败时为空"""
+    try:
+        with Image.open(variant_path(base, 'jpeg')) as thumb:
+            return _fingerprints(thumb)
+    except (OSError, SyntaxError, ValueError):
+        return {}
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 4 * 1024 * 1024  # 不小于该大小的文件用 mmap 一次性交给哈希函数，省去逐块复制
+
+
+def content_hash(path):
+    """原图内容摘要（BLAKE2b-128 的十六进制），用于识别不同分类中的重复照片"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def shared_thumbnail_base(shared_root, digest):
+    """内容相同的照片共用的缩略图：<共享目录>/<摘要前两位>/<摘要>.<格式扩展名>"""
+    return os.path.join(shared_root, digest[:2], digest)
+
+
+def _link_variants(src_base, dest_base, formats):
+    """把 src_base 的各格式版本硬链接到 dest_base（文件系统不支持硬链接时复制）
+
+    先链接到临时名再替换，已有的目标文件可能正链接着别的共享缩略图，不能原地覆盖。
+    """
+    os.makedirs(os.path.dirname(dest_base), exist_ok=True)
+    for fmt in formats:
+        src = variant_path(src_base, fmt)
+        dest = variant_path(dest_base, fmt)
+        try:
+            if os.path.samefile(src, dest):
+                continue
+        except OSError:
+            pass
+        tmp = dest + '.tmp'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+
+def _has_variants(base, formats):
+    return all(os.path.isfile(variant_path(base, fmt)) for fmt in formats)
+
+
+def release_shared_thumbnail(shared_root, digest, formats):
+    """照片删除或内容变化后调用：共享缩略图不再被任何照片链接（链接数只剩 1）时删除"""
+    base = shared_thumbnail_base(shared_root, digest)
+    for fmt in formats:
+        path = variant_path(base, fmt)
+        try:
+            if os.stat(path).st_nlink <= 1:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def _decode_reduced(img, size):
+    """单次解码出接近目标尺寸的图像
+
+    JPEG 通过 draft 让解码器直接输出 1/2、1/4、1/8 尺寸（DCT 域缩放），
+    其他格式完整解码后由 thumbnail 内部的 reduce 先做整数倍缩小。
+    load() 会真正解码数据，损坏或截断的文件在这里抛出异常，替代额外的 verify()。
+    """
+    target = (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP))
+    if img.format == 'JPEG':
+        img.draft(None, target)
+    img.load()
+    return img
+
+
+def render_thumbnail(src_path, dest_path, size, formats=None):
+    """生成缩略图并保存（不依赖 Flask 上下文，可在子进程中运行）
+
+    源文件只打开、解码一次。formats 为空时按 dest_path 的扩展名保存一份；
+    否则为每种格式各编码一份，保存到 variant_path(dest_path, 格式)。
+    返回 (是否成功, 错误信息)，由调用方负责记录日志。
+    """
+    ok, error, _ = process_photo(src_path, dest_path, size, formats, with_metadata=False)
+    return ok, error
+
+
+def process_photo(src_path, dest_path, size, formats=None, with_metadata=True, render=True, shared_root=None):
+    """扫描用：同一次打开中读取 EXIF 信息并生成缩略图，返回 (是否成功, 错误信息, 元数据)
+
+    render 为 False 时只读取元数据（dest_path 处的缩略图已是最新）；元数据读取失败不影响结果。
+    给出 shared_root 时先计算内容摘要：内容相同的照片共用 shared_root 下的一份缩略图，
+    dest_path 处的各格式版本是它的硬链接，已有共享缩略图时不再解码。
+    失败时元数据不为 None 表示源文件本身无法解码（损坏、截断、格式不支持），文件不变时重试也会失败；
+    为 None 表示源文件无法读取或其他原因（如写入缩略图失败），可以稍后重试。
+    """
+    metadata = dict.fromkeys(METADATA_FIELDS) if with_metadata else None
+    shared_base = None
+    if shared_root is not None and formats:
+        try:
+            digest = content_hash(src_path)
+        except OSError as e:
+            return False, f"无法读取源文件: {src_path} - {str(e)}", None
+        shared_base = shared_thumbnail_base(shared_root, digest)
+        if metadata is not None:
+            metadata['content_hash'] = digest
+
+    try:
+        try:
+            img = Image.open(src_path)
+        except (FileNotFoundError, PermissionError) as e:
+            return False, f"无法读取源文件: {src_path} - {str(e)}", None
+        except (IOError, SyntaxError) as e:
+            if not render:
+                return True, None, metadata
+            return False, f"损坏的图片文件: {src_path} - {str(e)}", metadata
+
+        with img:
+            if with_metadata:
+                # draft 会改变图像尺寸，必须在解码前读取
+                metadata.update((k, v) for k, v in read_metadata(img).items() if v is not None)
+
+            if shared_base is not None:
+                if _has_variants(shared_base, formats):
+                    # 重复照片：直接链接已有的共享缩略图
+                    _link_variants(shared_base, dest_path, formats)
+                    if with_metadata:
+                        metadata.update(_thumbnail_fingerprints(shared_base))
+                    return True, None, metadata
+                if not render and _has_variants(dest_path, formats):
+                    # 沿用的旧缩略图登记为共享缩略图，之后的重复照片链接到它
+                    _link_variants(dest_path, shared_base, formats)
+            if not render:
+                if with_metadata:
+                    metadata.update(_thumbnail_fingerprints(dest_path))
+                return True, None, metadata
+
+            # EXIF 方向为 5-8 的照片旋转后宽高互换，缩放时按旋转前的方向限制尺寸
+            if img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+                size = (size[1], size[0])
+
+            try:
+                _decode_reduced(img, size)
+            except IMAGE_ERRORS as e:
+                return False, f"损坏的图片文件: {src_path} - {str(e)}", metadata
+
+            # 转换模式（如果需要）：调色板等模式先转换再缩放，其余模式缩放后再转换以减少计算量
+            if img.mode not in _RESIZABLE_MODES:
+                img = img.convert('RGB')
+
+            # 保持比例缩放（reduce + LANCZOS）
+            img.thumbnail(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+            # 按 EXIF 方向旋转（缩小后再旋转，计算量小），像素方向与 read_metadata 给出的宽高一致
+            img = ImageOps.exif_transpose(img)
+
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            if with_metadata:
+                # 感知哈希和占位图直接取自缩小后的图像，不需要额外解码
+                metadata.update(_fingerprints(img))
+
+            # 先写入共享缩略图（进程号区分的临时名，完整写入后再替换），再链接到 dest_path
+            output_path = dest_path if shared_base is None else f"{shared_base}.{os.getpid()}"
+
+            # 创建目标目录（如果不存在）
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            # 保存缩略图
+            if not formats:
+                img.save(output_path, optimize=True, quality=85)
+            for fmt in formats or ():
+                options = THUMBNAIL_FORMATS[fmt][2]
+                encoded = img if img.mode == 'RGB' or fmt == 'jpeg' else img.convert('RGB')
+                encoded.save(variant_path(output_path, fmt), **options)
+
+            if shared_base is not None:
+                for fmt in formats:
+                    os.replace(variant_path(output_path, fmt), variant_path(shared_base, fmt))
+                _link_variants(shared_base, dest_path, formats)
+
+        return True, None, metadata
+    except IMAGE_ERRORS as e:
+        return False, f"生成缩略图失败 {src_path} -> {dest_path}: {str(e)}", None
+
+
+SPRITE_BACKGROUND = (240, 240, 240)
+
+
+def sprite_layout(count, columns):
+    """雪碧图布局：返回 (列数, 行数)，照片不足一行时按实际数量缩窄"""
+    columns = max(1, min(columns, count))
+    return columns, (count + columns - 1) // columns
+
+
+def render_sprite(tile_paths, dest_path, tile_size, columns):
+    """把一页缩略图拼成一张 JPEG 雪碧图，返回 (是否成功, 错误信息)
+
+    第 i 张按 tile_size 居中裁剪后放在第 i // 列数 行、第 i % 列数 列；
+    tile_paths 中为 None 或读取失败的位置留空（纯色），不影响其余照片。
+    """
+    tile_width, tile_height = tile_size
+    columns, rows = sprite_layout(len(tile_paths), columns)
+    try:
+        sheet = Image.new('RGB', (columns * tile_width, max(1, rows) * tile_height), SPRITE_BACKGROUND)
+        for index, path in enumerate(tile_paths):
+            if not path:
+                continue
+            try:
+                with Image.open(path) as tile:
+                    _decode_reduced(tile, tile_size)
+                    if tile.mode not in ('RGB', 'L'):
+                        tile = tile.convert('RGB')
+                    tile = ImageOps.fit(tile, tile_size, Image.LANCZOS)
+            except (OSError, SyntaxError, ValueError):
+                continue
+            sheet.paste(tile, ((index % columns) * tile_width, (index // columns) * tile_height))
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        sheet.save(dest_path, **THUMBNAIL_FORMATS['jpeg'][2])
+        return True, None
+    except Exception as e:
+        return False, f"生成雪碧图失败 {dest_path}: {str(e)}"
+
+
+class ThumbnailPool:
+    """缩略图进程池：解码、缩放和 EXIF 读取在子进程中并行执行，结果回到调用线程处理
+
+    workers <= 1 时不创建进程池，直接在调用线程中串行生成。
+    同时在途的任务数受 max_pending 限制，避免一次性提交整个图库。
+    给出 shared_root 时内容相同的照片共用一份缩略图（见 process_photo）。
+    """
+
+    def __init__(self, workers, size, formats=None, max_pending=None, shared_root=None):
+        self.workers = max(1, int(workers or 1))
+        self.size = size
+        self.formats = formats
+        self.shared_root = shared_root
+        self.max_pending = max_pending or self.workers * 4
+        self._executor = None
+        self._pending = {}  # future -> tag
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._pending.clear()
+        return False
+
+    def submit(self, tag, src_path, dest_path, render=True):
+        """提交一个任务（render 为 False 时只读取元数据），返回此时已完成的结果列表
+        [(tag, 是否成功, 错误信息, 元数据)]
+        """
+        args = (src_path, dest_path, self.size, self.formats, True, render, self.shared_root)
+        if self._executor is None:
+            return [(tag, *process_photo(*args))]
+
+        future = self._executor.submit(process_photo, *args)
+        self._pending[future] = tag
+        if len(self._pending) >= self.max_pending:
+            return self._collect(FIRST_COMPLETED)
+        return []
+
+    def drain(self):
+        """等待所有在途任务完成并返回结果"""
+        if not self._pending:
+            return []
+        return self._collect(ALL_COMPLETED)
+
+    def _collect(self, return_when):
+        done, _ = wait(list(self._pending), return_when=return_when)
+        results = []
+        for future in done:
+            tag = self._pending.pop(future)
+            try:
+                ok, error, metadata = future.result()
+            except BrokenProcessPool as e:
+                # 子进程崩溃也计为该文件失败；其他异常（程序错误）照常抛出
+                ok, error, metadata = False, f"缩略图子进程异常: {str(e)}", None
+            results.append((tag, ok, error, metadata))
+        return results
@@ -0,0 +1,244 @@
+"""照片目录监视器
+
+后台线程监听 PHOTO_FOLDER/<分类> 下的文件新建、修改、删除和改名，
+按 AUTO_SCAN_DELAY 去抖后把一批变化交给索引回调。
+Linux 下使用 inotify（通过 ctypes 调用，无额外依赖），其他平台退回定时轮询。
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 事件中的特殊标记：(分类, None) 表示整个分类目录变化，(None, None) 表示需要完整扫描
+FULL_RESCAN = (None, None)
+
+
+def _is_hidden(name):
+    return name.startswith(('.', '~'))
+
+
+class _InotifyBackend:
+    """基于 inotify 的事件源：根目录监听分类目录的增删，分类目录监听文件变化"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    CATEGORY_MASK = (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_DELETE |
+                     IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR)
+
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, photo_root):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 失败: {os.strerror(err)}")
+
+        self.photo_root = photo_root
+        self._watches = {}  # wd -> 分类名（根目录为 None）
+        self._root_wd = self._add_watch(photo_root, self.ROOT_MASK, None)
+        with os.scandir(photo_root) as entries:
+            for entry in entries:
+                if not _is_hidden(entry.name) and entry.is_dir():
+                    self._watch_category(entry.name)
+
+    def _add_watch(self, path, mask, category):
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch 失败 ({path}): {os.strerror(err)}")
+        self._watches[wd] = category
+        return wd
+
+    def _watch_category(self, category):
+        try:
+            self._add_watch(os.path.join(self.photo_root, category), self.CATEGORY_MASK, category)
+        except OSError as e:
+            logger.warning(f"无法监听分类目录 {category}: {e}")
+
+    def read(self, timeout):
+        """等待事件（最多 timeout 秒），返回 [(分类, 文件名或None)]"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        header_size = self._EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            wd, mask, _cookie, length = self._EVENT_HEADER.unpack_from(data, offset)
+            raw_name = data[offset + header_size:offset + header_size + length].split(b'\0', 1)[0]
+            offset += header_size + length
+            name = os.fsdecode(raw_name)
+
+            if mask & self.IN_Q_OVERFLOW:
+                events.append(FULL_RESCAN)
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            if wd == self._root_wd:
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    events.append(FULL_RESCAN)
+                elif mask & self.IN_ISDIR and not _is_hidden(name):
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        self._watch_category(name)
+                    events.append((name, None))
+                continue
+
+            category = self._watches.get(wd)
+            if category is None or not name or mask & self.IN_ISDIR:
+                continue
+            events.append((category, name))
+        return events
+
+    def close(self):
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+
+class _PollingBackend:
+    """轮询事件源：定期用 os.scandir 快照比对 (大小, 修改时间)"""
+
+    def __init__(self, photo_root, interval):
+        self.photo_root = photo_root
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.photo_root) as categories:
+                category_entries = [entry for entry in categories
+                                    if not _is_hidden(entry.name) and entry.is_dir()]
+        except OSError as e:
+            logger.warning(f"轮询照片根目录失败: {e}")
+            return snapshot
+        for category_entry in category_entries:
+            try:
+                with os.scandir(category_entry.path) as entries:
+                    for entry in entries:
+                        if _is_hidden(entry.name) or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                        snapshot[(category_entry.name, entry.name)] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return snapshot
+
+    def read(self, timeout):
+        wait = self._next_poll - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self._next_poll:
+                return []
+        self._next_poll = time.monotonic() + self.interval
+
+        current = self._take_snapshot()
+        previous = self._snapshot
+        self._snapshot = current
+        changed = [key for key, value in current.items() if previous.get(key) != value]
+        changed.extend(key for key in previous if key not in current)
+        return changed
+
+    def close(self):
+        pass
+
+
+class PhotoWatcher(threading.Thread):
+    """后台监视线程：收集事件，静默 delay 秒后批量交给 on_changes 回调
+
+    on_changes(events) 返回 False 表示暂时无法处理（例如全量扫描进行中），
+    事件会保留并在下一轮重试。
+    """
+
+    def __init__(self, photo_root, on_changes, delay, poll_interval=10, use_inotify=True, log=None):
+        super().__init__(name='photo-watcher', daemon=True)
+        self.logger = log or logger
+        self.photo_root = photo_root
+        self.on_changes = on_changes
+        self.delay = max(0.1, float(delay))
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self._stop_event = threading.Event()
+        self._pending = set()
+        self._last_event = 0.0
+
+    def _create_backend(self):
+        if self.use_inotify and sys.platform.startswith('linux'):
+            try:
+                backend = _InotifyBackend(self.photo_root)
+                self.logger.info("照片目录监视器已启动（inotify）")
+                return backend
+            except (OSError, AttributeError) as e:
+                self.logger.warning(f"inotify 不可用，改用轮询: {e}")
+        self.logger.info(f"照片目录监视器已启动（轮询，间隔 {self.poll_interval} 秒）")
+        return _PollingBackend(self.photo_root, self.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        try:
+            backend = self._create_backend()
+        except OSError as e:
+            self.logger.error(f"照片目录监视器启动失败: {e}")
+            return
+
+        try:
+            while not self._stop_event.is_set():
+                events = backend.read(self.delay)
+                if events:
+                    self._pending.update(events)
+                    self._last_event = time.monotonic()
+                    continue
+
+                # 静默 delay 秒后再处理，合并同一文件的连续写入
+                if self._pending and time.monotonic() - self._last_event >= self.delay:
+                    batch, self._pending = self._pending, set()
+                    try:
+                        handled = self.on_changes(batch)
+                    except Exception as e:
+                        self.logger.error(f"处理目录变化失败: {e}")
+                        handled = True
+                    if handled is False:
+                        self._pending |= batch
+                        self._last_event = time.monotonic()
+        finally:
+            backend.close()
@@ -0,0 +1,18 @@
+"""生产环境 WSGI 入口
+
+    waitress-serve --listen=0.0.0.0:5000 --threads=16 wsgi:app              # Windows / 跨平台，单进程多线程
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 --graceful-timeout 15 wsgi:app   # Linux，多进程多线程
+
+每个 worker 进程各自创建应用；启动扫描和照片目录监视只在获得后台任务锁的那个进程中运行
+（见 app.start_background_tasks），其他进程通过数据库中的扫描状态和索引版本号同步。
+使用 gunicorn 时不要加 --preload，否则后台线程会在 master 进程中启动。
+"""
+import atexit
+
+from app import create_app, start_background_tasks, stop_background_tasks
+
+app = create_app()
+
+if start_background_tasks(app):
+    # worker 正常退出时让扫描在检查点提交后结束
+    atexit.register(stop_background_tasks, app)